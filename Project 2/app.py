@@ -1,20 +1,65 @@
+import time
+
+# When the import started, for the startup timings
+import_start = time.time()
+
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
-import dash_table_experiments as dt
+import dash_table
+import flask
+import numpy as np
+from dash.exceptions import PreventUpdate
 
+# Preloaded by the gunicorn master, see gunicorn.conf.py
+libraries_end = time.time()
+
+import json
 import os
-import pandas as pd
+import threading
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from textwrap import dedent as d
 
 # the data retrieval and processing module
 import process
 
-# the graph creation module
-import graphs
+# the server side store for intermediate frames
+import cache
+
+# the precomputed crime aggregates
+import cube
+
+# the callback instrumentation
+import metrics
+
+# the response compression
+import compress
+
+# the columnar copies and snapshots of the data
+import storage
+
+# the swap of reloaded data under running requests
+import reloader
+
+# the per session request versions, to drop superseded requests
+import versions
+
+# the selected table rows of every session
+import selections
+
+# The graph creation (graphs), the count models (model), the compact figure
+# payloads (encoding), the grouped aggregates of /api/query (query) and the
+# downloads of the filtered rows (export) are imported where they are first
+# used, off the startup path
 
 # the parameters for filtering
-from config import variables, crime_types, base_columns
+import config
+from config import variables, crime_types, monthly_variables
+from config import base_columns, table_page_size, figure_threads
+from config import model_families, binary_figures, reload_interval
 
 
 app = dash.Dash(__name__)
@@ -23,200 +68,130 @@ app.title = 'Exploring Crimes Dashboard'
 
 server = app.server
 server.secret_key = os.environ.get('SECRET_KEY', 'my-secret-key')
+compress.init_app(server)
+metrics.init_app(server)
 
-# Get and process the data
-df = process.get_data()
+# The loaded data and everything derived from it, swapped as a whole on a
+# reload. Requests read the dataset current when they started.
+Dataset = namedtuple('Dataset', ['df', 'month_df', 'crime_cube', 'validity',
+                                 'page_layout', 'key', 'generation',
+                                 'loaded', 'seconds'])
+dataset = reloader.DoubleBuffer()
+dataset.init_app(server)
+load_lock = threading.Lock()
 
-app.layout = html.Div(children=[
 
-    # The controls
-    html.Div([
+def get_dataset():
 
-        # The checkboxes
-        html.Div([
-            html.H5('Crime Types'),
-            dcc.Checklist(
-                id='crime_checks',
-                options=[{'label': i, 'value': i} for i in crime_types],
-                values=crime_types,
-                labelStyle={'display': 'inline-block'
-                            },
-            ),
+    return dataset.current()
 
-        ],
-            style={'width': '49%', 'display': 'inline-block'}
-        ),
 
-        # The dropdowns
-        html.Div([
-            dcc.Markdown(d("""
-                **Select Variables**
-              """)),
-            dcc.Dropdown(
-                id='crossfilter-variable1-column',
-                options=[{'label': i, 'value': i} for i in
-                         variables],
-                value=variables[0]
-            ),
-            dcc.RadioItems(
-                id='crossfilter-variable1-type',
-                options=[{'label': i, 'value': i} for i
-                         in ['Linear', 'Log']],
-                value='Linear',
-                labelStyle={'display': 'inline-block'}
-            ),
+# Values cached from one load of the data are never found from another
+cache.set_namespace(lambda: getattr(get_dataset(), 'generation', 0))
+metrics.record_startup('libraries', libraries_end - import_start)
+metrics.record_startup('imports', time.time() - import_start)
 
-            dcc.RadioItems(
-                id='crossfilter-variable1-agg',
-                options=[{'label': i, 'value': i} for i
-                         in ['Avg', 'Sum']],
-                value='Avg',
-                labelStyle={
-                    'display': 'inline-block',
-                }
-            )
-        ],
-            style={'width': '24%', 'display': 'inline-block'}),
+# Frames computed per crime type selection, the browser only holds the
+# filter spec. They share the columns of the data and add only the total.
+crime_frames = cache.LRUCache(maxsize=32, name='crime_frames')
 
-        html.Div([
-            dcc.Dropdown(
-                id='crossfilter-variable2-column',
-                options=[{'label': i, 'value': i}
-                         for i in variables],
-                value=variables[1]
-            ),
-            dcc.RadioItems(
-                id='crossfilter-variable2-type',
-                options=[{'label': i, 'value': i}
-                         for i in ['Linear', 'Log']],
-                value='Linear',
-                labelStyle={'display': 'inline-block'}
-            ),
+# Figures by a hash of everything they are built from
+figures = cache.LRUCache(maxsize=256, ttl=3600, name='figures')
 
-            dcc.RadioItems(
-                id='crossfilter-variable2-agg',
-                options=[{'label': i, 'value': i} for i
-                         in ['Avg', 'Sum']],
-                value='Avg',
-                labelStyle={
-                    'display': 'inline-block',
-                }
-            )
-        ], style={'width': '24%',
-                  'display': 'inline-block'})
-    ], style={
-        'borderBottom': 'thin lightgrey solid',
-        'backgroundColor': 'rgb(250, 250, 250)',
-        'padding': '10px 5px'}
-
-    ),
-
-    # The plots
-    html.Div([
-
-        # The map
-        html.Div([
-            dcc.Graph(
-                id='crossfilter-state-map',
-                clickData={'points': [{'customdata': 'TX'}]}
-            ),
-        ], className='one-thirdcolumn',
-            style={'width': '47%',
-                   # 'height': '90vh',
-                   'display': 'inline-block',
-                   'padding-top': '10px',
-                   'padding-right': '20px',
-                   'padding-bottom': '20px',
-                   'padding-left': '20px'}
-        ),
+# Row positions and yearly aggregates of a filter spec, shared by all the
+# figures. The rows themselves are taken per request, so no copy of the
+# columns is kept.
+spec_frames = cache.LRUCache(maxsize=32, name='spec_frames')
+spec_lock = threading.RLock()
 
+# Builds the figures of one interaction concurrently
+figure_pool = ThreadPoolExecutor(max_workers=figure_threads)
 
-        # The time series
-        html.Div([
-            dcc.Graph(id='x-time-series'),
-            dcc.Graph(id='y-time-series'),
-        ], className='threecolumns',
-            style={'width': '47%',
-                   # 'height': '90vh',
-                   'display': 'inline-block',
-                   'padding-top': '10px',
-                   'padding-right': '20px',
-                   'padding-bottom': '20px',
-                   'padding-left': '20px'}
-        ),
+# Count model fits by filter spec, and the last fit of every crime
+# selection and variable to warm start the next spec from
+models = cache.LRUCache(maxsize=64, name='models')
+model_starts = cache.LRUCache(maxsize=256, name='model_starts')
+
+# Results of /api/query and query_data by the parsed query
+query_results = cache.LRUCache(maxsize=128, ttl=3600, name='queries')
+
+# Sort ranks of the table columns and the row orders of the table sorts
+# and filters, by filter spec, so paging only slices
+sort_ranks = cache.LRUCache(maxsize=128, name='sort_ranks')
+table_orders = cache.LRUCache(maxsize=64, name='table_orders')
+
+
+def build_layout(df):
+    '''The page, with the state and year choices of the data'''
 
-        # The scatter plot
+    return html.Div(children=[
+
+        # The controls
         html.Div([
-            dcc.Graph(
-                id='scatter1',
-                style={
-                    'width': '47%',
-                    # 'height': '90vh',
-                    'display': 'inline-block',
-                    'padding-top': '10px',
-                    'padding-right': '20px',
-                    'padding-bottom': '10px',
-                    'padding-left': '10px'}
+
+            # The checkboxes
+            html.Div([
+                html.H5('Crime Types'),
+                dcc.Checklist(
+                    id='crime_checks',
+                    options=[{'label': i, 'value': i} for i in crime_types],
+                    values=crime_types,
+                    labelStyle={'display': 'inline-block'
+                                },
+                ),
+
+            ],
+                style={'width': '49%', 'display': 'inline-block'}
             ),
-            dcc.Graph(
-                id='scatter2',
-                style={
-                    'width': '47%',
-                    # 'height': '90vh',
-                    'display': 'inline-block',
-                    'padding-top': '10px',
-                    'padding-right': '10px',
-                    'padding-bottom': '10px',
-                    'padding-left': '20px'}
-            )
-        ], className='threecolumns',
-        ),
-        html.Div([
 
-            # The States Dropdown
+            # The dropdowns
             html.Div([
                 dcc.Markdown(d("""
-                **Select States**
-              """)),
+                    **Select Variables**
+                  """)),
                 dcc.Dropdown(
-                    id='state_checks',
+                    id='crossfilter-variable1-column',
                     options=[{'label': i, 'value': i} for i in
-                             df.State_Abbrev.unique()],
-                    multi=True,
-                    value=df.State_Abbrev.unique()
+                             variables],
+                    value=variables[0]
                 ),
-            ], style={'width': '100%',
-                      'display': 'inline-block',
-                      'padding-top': '10px',
-                      'padding-right': '10px',
-                      'padding-bottom': '10px',
-                      'padding-left': '5px'}),
-
-            # The line Input
-            html.Div([
-                dcc.Markdown(d("""
-                **Input Year to draw line**
-              """)),
-                dcc.Input(
-                    id='year_line',
-                    placeholder='Enter a value...',
-                    type='number',
-                    min=df.Year.min(),
-                    max=df.Year.max(),
-                    size=200,
-                    style={'display': 'inline-block',
-                           'width': '30%',
-                           'padding-top': '10px',
-                           'padding-right': '10px',
-                           'padding-bottom': '30px',
-                           'padding-left': '20px'},
-                    value=None
+                dcc.RadioItems(
+                    id='crossfilter-variable1-type',
+                    options=[{'label': i, 'value': i} for i
+                             in ['Linear', 'Log']],
+                    value='Linear',
+                    labelStyle={'display': 'inline-block'}
                 ),
-            ]),
-            # The agg choice
+
+                dcc.RadioItems(
+                    id='crossfilter-variable1-agg',
+                    options=[{'label': i, 'value': i} for i
+                             in ['Avg', 'Sum']],
+                    value='Avg',
+                    labelStyle={
+                        'display': 'inline-block',
+                    }
+                )
+            ],
+                style={'width': '24%', 'display': 'inline-block'}),
+
             html.Div([
+                dcc.Dropdown(
+                    id='crossfilter-variable2-column',
+                    options=[{'label': i, 'value': i}
+                             for i in variables],
+                    value=variables[1]
+                ),
                 dcc.RadioItems(
-                    id='crossfilter-crimetype-agg',
+                    id='crossfilter-variable2-type',
+                    options=[{'label': i, 'value': i}
+                             for i in ['Linear', 'Log']],
+                    value='Linear',
+                    labelStyle={'display': 'inline-block'}
+                ),
+
+                dcc.RadioItems(
+                    id='crossfilter-variable2-agg',
                     options=[{'label': i, 'value': i} for i
                              in ['Avg', 'Sum']],
                     value='Avg',
@@ -224,222 +199,856 @@ app.layout = html.Div(children=[
                         'display': 'inline-block',
                     }
                 )
-            ]),
+            ], style={'width': '24%',
+                      'display': 'inline-block'})
+        ], style={
+            'borderBottom': 'thin lightgrey solid',
+            'backgroundColor': 'rgb(250, 250, 250)',
+            'padding': '10px 5px'}
+
+        ),
+
+        # The plots
+        html.Div([
+
+            # The map
             html.Div([
-                # The Year Slider
-                dcc.Markdown(d("""
-                    **Select Year Range**
+                dcc.Graph(
+                    id='crossfilter-state-map',
+                    clickData={'points': [{'customdata': 'TX'}]}
+                ),
+            ], className='one-thirdcolumn',
+                style={'width': '47%',
+                       # 'height': '90vh',
+                       'display': 'inline-block',
+                       'padding-top': '10px',
+                       'padding-right': '20px',
+                       'padding-bottom': '20px',
+                       'padding-left': '20px'}
+            ),
+
+
+            # The time series
+            html.Div([
+                dcc.Graph(id='x-time-series'),
+                dcc.Graph(id='y-time-series'),
+            ], className='threecolumns',
+                style={'width': '47%',
+                       # 'height': '90vh',
+                       'display': 'inline-block',
+                       'padding-top': '10px',
+                       'padding-right': '20px',
+                       'padding-bottom': '20px',
+                       'padding-left': '20px'}
+            ),
+
+            # The scatter plot
+            html.Div([
+                dcc.Graph(
+                    id='scatter1',
+                    style={
+                        'width': '47%',
+                        # 'height': '90vh',
+                        'display': 'inline-block',
+                        'padding-top': '10px',
+                        'padding-right': '20px',
+                        'padding-bottom': '10px',
+                        'padding-left': '10px'}
+                ),
+                dcc.Graph(
+                    id='scatter2',
+                    style={
+                        'width': '47%',
+                        # 'height': '90vh',
+                        'display': 'inline-block',
+                        'padding-top': '10px',
+                        'padding-right': '10px',
+                        'padding-bottom': '10px',
+                        'padding-left': '20px'}
+                )
+            ], className='threecolumns',
+            ),
+            html.Div([
+
+                # The States Dropdown
+                html.Div([
+                    dcc.Markdown(d("""
+                    **Select States**
+                  """)),
+                    dcc.Dropdown(
+                        id='state_checks',
+                        options=[{'label': i, 'value': i} for i in
+                                 df.State_Abbrev.unique()],
+                        multi=True,
+                        value=df.State_Abbrev.unique()
+                    ),
+                ], style={'width': '100%',
+                          'display': 'inline-block',
+                          'padding-top': '10px',
+                          'padding-right': '10px',
+                          'padding-bottom': '10px',
+                          'padding-left': '5px'}),
+
+                # The line Input
+                html.Div([
+                    dcc.Markdown(d("""
+                    **Input Year to draw line**
+                  """)),
+                    dcc.Input(
+                        id='year_line',
+                        placeholder='Enter a value...',
+                        type='number',
+                        min=df.Year.min(),
+                        max=df.Year.max(),
+                        size=200,
+                        style={'display': 'inline-block',
+                               'width': '30%',
+                               'padding-top': '10px',
+                               'padding-right': '10px',
+                               'padding-bottom': '30px',
+                               'padding-left': '20px'},
+                        value=None
+                    ),
+                ]),
+                # The agg choice
+                html.Div([
+                    dcc.RadioItems(
+                        id='crossfilter-crimetype-agg',
+                        options=[{'label': i, 'value': i} for i
+                                 in ['Avg', 'Sum']],
+                        value='Avg',
+                        labelStyle={
+                            'display': 'inline-block',
+                        }
+                    )
+                ]),
+                # The time series resolution
+                html.Div([
+                    dcc.Markdown(d("""
+                    **Variable Time Series Resolution**
+                  """)),
+                    dcc.RadioItems(
+                        id='granularity',
+                        options=[{'label': i, 'value': i} for i
+                                 in ['Year', 'Month']],
+                        value='Year',
+                        labelStyle={
+                            'display': 'inline-block',
+                        }
+                    )
+                ]),
+                # The count model drawn over the scatter plots
+                html.Div([
+                    dcc.Markdown(d("""
+                    **Count Model Fit**
                   """)),
-                dcc.RangeSlider(
-                    id='crossfilter-year-slider',
-                    min=1995,
-                    max=2016,
-                    value=[1995,2016],
-                    step=None,
-                    marks={str(year): str(year) for year in df['Year'].unique()}
-                )], style={'width': '97%',
-                           'display': 'inline-block',
-                           'padding-top': '10px',
-                           'padding-right': '10px',
-                           'padding-bottom': '30px',
-                           'padding-left': '20px'})
+                    dcc.RadioItems(
+                        id='model-family',
+                        options=[{'label': i, 'value': i} for i
+                                 in model_families],
+                        value='None',
+                        labelStyle={
+                            'display': 'inline-block',
+                        }
+                    )
+                ]),
+                html.Div([
+                    # The Year Slider
+                    dcc.Markdown(d("""
+                        **Select Year Range**
+                      """)),
+                    dcc.RangeSlider(
+                        id='crossfilter-year-slider',
+                        min=1995,
+                        max=2016,
+                        value=[1995,2016],
+                        step=None,
+                        marks={str(year): str(year) for year in df['Year'].unique()}
+                    )], style={'width': '97%',
+                               'display': 'inline-block',
+                               'padding-top': '10px',
+                               'padding-right': '10px',
+                               'padding-bottom': '30px',
+                               'padding-left': '20px'})
+
+            ]),
+
+            html.Div([
+                # The Total Crimes time series
+                dcc.Graph(id='time-series')],
+                className='threecolumns',
+                style={
+                'display': 'inline-block',
+                'width': '97%',
+                'padding-top': '0px',
+                'padding-right': '20px',
+                'padding-bottom': '10px',
+                'padding-left': '20px'}),
+
+            # The table
+            html.Div([
+                dash_table.DataTable(
+                    # The rows are paged, sorted and filtered on the server
+                    id='table',
+                    columns=[{'name': i, 'id': i} for i in
+                             base_columns + variables + crime_types +
+                             ['total_crimes']],
+                    data=[],
+                    pagination_mode='be',
+                    pagination_settings={
+                        'current_page': 0,
+                        'page_size': table_page_size
+                    },
+                    sorting='be',
+                    sorting_type='multi',
+                    sorting_settings=[],
+                    filtering='be',
+                    filtering_settings='',
+                    row_selectable='multi',
+                    selected_rows=[],
+                    style_table={'overflowX': 'scroll'}
+                ),
+                html.Div(id='selected-indexes'),
+            ], style={
+                'width': '95%',
+                'padding-top': '10px',
+                'padding-right': '20px',
+                'padding-bottom': '10px',
+                'padding-left': '20px'},
+
+                className='threecolumns'
 
-        ]),
-        
-        html.Div([
-            # The Total Crimes time series
-            dcc.Graph(id='time-series')],
-            className='threecolumns',
-            style={
-            'display': 'inline-block',
-            'width': '97%',
-            'padding-top': '0px',
-            'padding-right': '20px',
-            'padding-bottom': '10px',
-            'padding-left': '20px'}),
-
-        # The table
-        html.Div([
-            dt.DataTable(
-                # Initialise the rows
-                rows=df.to_dict('records'),
-                row_selectable=True,
-                filterable=True,
-                sortable=True,
-                selected_row_indices=[],
-                id='table'
             ),
-            html.Div(id='selected-indexes'),
-        ], style={
-            'width': '95%',
-            'padding-top': '10px',
-            'padding-right': '20px',
-            'padding-bottom': '10px',
-            'padding-left': '20px'},
 
-            className='threecolumns'
+        ]),
 
-        ),
+        # Hidden div inside the app that stores the filter spec, the data it
+        # describes is held on the server
+        html.Div(id='filter-spec', style={'display': 'none'}),
 
-    ]),
+        # The number of selected table rows, their row_ids are kept on the
+        # server by session
+        html.Div(id='selected-rows', children=0, style={'display': 'none'})
 
-    # Hidden div inside the app that stores the intermediate value
-    html.Div(id='intermediate-value', style={'display': 'none'})
+    ])
 
-])
 
+def serve_layout():
+    '''The page with a new session id, so the requests of every page load
+    are versioned on their own'''
 
-@app.callback(
-    dash.dependencies.Output('intermediate-value', 'children'),
-    [dash.dependencies.Input('crime_checks', 'values')]
-)
-def update_df(crime_checks):
-    ''''''
-    dfm = df.copy()
-    dfm = df[base_columns + variables + crime_checks]
-    dfm['total_crimes'] = dfm[crime_checks].sum(axis=1)
+    return html.Div([
+        get_dataset().page_layout,
+        html.Div(id='session-id', children=uuid.uuid4().hex,
+                 style={'display': 'none'})
+    ])
 
-    return dfm.to_json()
 
+def get_snapshot_key():
+    '''What the derived data and layout are built from, the data files
+    and the code that builds them'''
 
-@app.callback(
-    dash.dependencies.Output('crossfilter-state-map', 'figure'),
-    [dash.dependencies.Input('table', 'rows'),
-     dash.dependencies.Input('crime_checks', 'values')]
-)
-def update_map(rows, crime_checks):
-    ''''''
-    dfm = pd.DataFrame(rows)
-    dfm = dfm.groupby(['State_Abbrev', 'State']).sum()
-    dfm = dfm.reset_index()
+    return storage.get_files_key(
+        [os.path.join('data', 'Year_df.csv'),
+         os.path.join('data', 'Month_df.csv'),
+         __file__, process.__file__, cube.__file__, config.__file__])
 
-    return graphs.create_map(dfm, crime_checks)
 
+def get_data_key():
+    '''Changes when the data files are replaced'''
 
-@app.callback(
-    dash.dependencies.Output('scatter1', 'figure'),
-    [dash.dependencies.Input('table', 'rows'),
-     dash.dependencies.Input('crime_checks', 'values'),
-     dash.dependencies.Input('crossfilter-variable1-column', 'value'),
-     dash.dependencies.Input('crossfilter-variable1-type', 'value')
-     ]
-)
-def update_scattter1(rows,
-                     crime_checks,
-                     variable1_column_name,
-                     variable1_type_name):
+    return storage.get_files_key(
+        [os.path.join('data', 'Year_df.csv'),
+         os.path.join('data', 'Month_df.csv')])
+
+
+def load_data(dfl=None):
+    '''(Re)load the data, or use the given frame, and swap it in. Requests
+    in flight finish on the old data, later ones get the new data and
+    nothing cached from the old.
+
+    The cube, validity masks and layout of the data files are kept in a
+    snapshot, reused by the next start while the data is unchanged.
+    '''
+    with load_lock:
+        start = time.time()
+
+        # Before reading, so files replaced during the read give a key the
+        # next load sees as changed rather than one for the old content
+        key = get_snapshot_key() if dfl is None else None
+
+        df = process.get_data() if dfl is None else dfl
+        month_df = process.get_month_data()
+
+        snapshot = storage.read_snapshot('data', 'app', key) if key else None
+
+        if snapshot is None:
+            with metrics.timed_startup('derive'):
+                snapshot = (cube.build_cube(df),
+                            process.get_validity(df, variables),
+                            build_layout(df))
+            if key:
+                storage.write_snapshot('data', 'app', key, snapshot)
 
-    dfs = pd.DataFrame(rows)
+        old = dataset.latest()
+        generation = 1 if old is None else old.generation + 1
+        now = time.time()
+
+        dataset.swap(Dataset(df, month_df, *snapshot, key=key,
+                             generation=generation, loaded=now,
+                             seconds=now - start))
+        app.layout = serve_layout
+        cache.clear_all()
+
+    metrics.set_gauge('dash_data_generation', generation)
+    metrics.set_gauge('dash_data_load_seconds', now - start)
+    metrics.set_gauge('dash_data_loaded_timestamp_seconds', now)
+
+
+# Get and process the data, the files replaced from now on are reloaded
+data_key = get_data_key()
+with metrics.timed_startup('data'):
+    load_data()
+
+# Load the data again whenever its files are replaced
+watcher = None
+if reload_interval:
+    watcher = reloader.Watcher(get_data_key, load_data, reload_interval,
+                               data_key)
+    watcher.start()
+
+
+def get_selection_key():
+    '''What the row_ids of a table selection refer to, the loaded data,
+    the same in every worker'''
+    data = get_dataset()
+
+    return data.key if data.key is not None else data.generation
+
+
+def get_crime_frame(crime_checks):
+    '''Look up the stored frame for a crime selection, computing it on a
+    miss'''
+    key = cache.make_key(sorted(crime_checks))
+    dfm = crime_frames.get(key)
+
+    if dfm is None:
+        data = get_dataset()
+        dfm = process.get_crime_frame(data.df, crime_checks, data.crime_cube)
+        crime_frames.put(key, dfm)
+
+    return dfm
+
+
+def get_total_validity(crime_checks):
+    '''Look up the valid total_crimes rows of a crime selection, computing
+    them on a miss'''
+    key = cache.make_key('valid', sorted(crime_checks))
+    valid = crime_frames.get(key)
+
+    if valid is None:
+        dfm = get_crime_frame(crime_checks)
+        valid = process.get_validity(dfm, ['total_crimes'])['total_crimes']
+        valid = valid.values
+        crime_frames.put(key, valid)
+
+    return valid
+
+
+def get_shared(key, compute):
+    '''Look up a stored intermediate of a filter spec, computing it once
+    on a miss even when several figures ask at the same time'''
+    value = spec_frames.get(key)
+
+    if value is None:
+        with spec_lock:
+            value = spec_frames.get(key)
+            if value is None:
+                value = compute()
+                spec_frames.put(key, value)
+
+    return value
+
+
+def resolve_spec(spec):
+    '''Turn a filter spec from the browser into the filtered frame'''
+
+    dfm = get_crime_frame(spec['crimes'])
+
+    def compute():
+        with metrics.timed('frame'):
+            return process.get_spec_positions(dfm, spec['states'],
+                                              spec['years'])
+
+    positions = get_shared(cache.make_key('rows', spec), compute)
+    with metrics.timed('frame'):
+        dfs = process.take_rows(dfm, positions)
+    metrics.record_rows(len(dfs))
+
+    return dfs
+
+
+def get_year_frame(spec, agg):
+    '''The variables of the spec rows aggregated by Year'''
+
+    def compute():
+        dfs = resolve_spec(spec)
+        with metrics.timed('frame'):
+            return process.get_year_frame(dfs, agg)
+
+    return get_shared(cache.make_key('years', spec, agg), compute)
+
+
+def get_sort_ranks(spec, dfs, column, direction):
+    '''Look up the stored sort ranks of a column of the spec rows'''
+    key = cache.make_key(spec, column, direction)
+    ranks = sort_ranks.get(key)
+
+    if ranks is None:
+        ranks = process.get_sort_ranks(dfs[column].values, direction)
+        sort_ranks.put(key, ranks)
+
+    return ranks
+
+
+def get_table_order(spec, dfs, sorting_settings, filtering_settings):
+    '''Look up the stored row order of a table sorting and filter'''
+    key = cache.make_key(spec, sorting_settings, filtering_settings)
+    order = table_orders.get(key)
+
+    if order is None:
+        columns = process.get_crime_columns(spec['crimes'])
+        with metrics.timed('frame'):
+            # A filter the table can not apply matches no rows
+            try:
+                mask = process.get_table_mask(dfs, filtering_settings,
+                                              columns)
+            except ValueError:
+                mask = np.zeros(len(dfs), dtype=bool)
+
+            order = process.get_table_order(
+                mask, sorting_settings, partial(get_sort_ranks, spec, dfs),
+                columns)
+        table_orders.put(key, order)
+
+    return order
+
+
+def load_spec(jsonified_spec):
+    '''The filter spec from the browser and its version, which is kept
+    out of the spec so it never reaches a cache key'''
+    spec = json.loads(jsonified_spec)
+
+    return spec, spec.pop('version', None)
+
+
+def stop_if_superseded(callback, version, spec_version=None):
+    '''Drop a request once a newer one from the same session is known,
+    the browser would not show its result'''
+
+    session_id = None if version is None else version.key[0]
+
+    if versions.is_current(version) and\
+            versions.is_current_spec(session_id, spec_version):
+        return
+
+    metrics.increment('dash_callback_superseded_total',
+                      metrics.get_callback_id(callback))
+    raise PreventUpdate
+
+
+def skip_if_superseded(version, build):
+    '''Wrap a figure build to return None without building once the
+    request is superseded'''
+
+    def wrapper(*args):
+        if not versions.is_current(version):
+            return None
+        return build(*args)
+
+    return wrapper
+
+
+def encode_figure(fig):
+    '''The figure as sent to the browser'''
+    import encoding
+
+    return encoding.encode_figure(fig) if binary_figures else fig
+
+
+@cache.memoize(figures)
+def build_map(spec):
+    import graphs
+
+    with metrics.timed('frame'):
+        dfm = cube.get_state_totals(get_dataset().crime_cube,
+                                    spec['crimes'], spec['states'],
+                                    spec['years'])
+
+    return encode_figure(graphs.create_map(dfm, spec['crimes']))
+
+
+@cache.memoize(models)
+def fit_models(spec, variable, family):
+    '''Regressions of the selected crimes and their total on a variable
+    over the spec rows, warm started from the last fit of the same crimes
+    and variable'''
+    import model
+
+    dfs = resolve_spec(spec)
+    key = cache.make_key(spec['crimes'], variable, family)
+
+    fit = model.fit_crime_models(dfs, spec['crimes'], variable, family,
+                                 model_starts.get(key))
+    if fit is not None:
+        model_starts.put(key, fit)
+
+    return fit
+
+
+@cache.memoize(figures)
+def build_scatter(spec, variable, variable_type, color, family='None'):
+    import graphs
+    import model
+
+    dfs = resolve_spec(spec)
     dfs, state_abbrev = process.get_state(dfs)
 
-    return graphs.create_scatter(dfs, variable1_column_name,
-                                 variable1_type_name, state_abbrev,
-                                 None)
+    # The rows with both values, from the masks of the whole data
+    data = get_dataset()
+    rows = data.df.index.get_indexer(dfs.index)
+    valid = (data.validity[variable].values &
+             get_total_validity(spec['crimes']))[rows]
+
+    fig = graphs.create_scatter(dfs, variable, variable_type,
+                                state_abbrev, color, valid)
+
+    fit = fit_models(spec, variable, family) if family in model.FAMILIES\
+        else None
+    if fit is not None:
+        values = dfs[variable].to_numpy(float, na_value=np.nan)[valid]
+        graphs.add_fit(fig, fit, family, values.min(), values.max(),
+                       variable_type != 'Linear', color)
+
+    return encode_figure(fig)
+
+
+@cache.memoize(figures)
+def build_variable_timeseries(spec, variable, variable_type, agg, color,
+                              granularity):
+    import graphs
+
+    # Crimes and most variables are only observed yearly
+    if granularity == 'Month' and variable in monthly_variables:
+        with metrics.timed('frame'):
+            dfs = process.get_spec_rows(get_dataset().month_df,
+                                        spec['states'], spec['years'])
+        metrics.record_rows(len(dfs))
+        x = 'Date'
+    else:
+        dfs = get_year_frame(spec, agg)
+        x = 'Year'
+
+    dfs = dfs[[x, variable]]
+    title = '{}'.format(variable)
+    return encode_figure(graphs.create_time_series(
+        dfs, variable_type, variable, title, color, None, agg, x))
+
+
+@cache.memoize(figures)
+def build_crimetype_timeseries(spec, year_line, agg):
+    import graphs
+
+    with metrics.timed('frame'):
+        dfs = cube.get_year_totals(get_dataset().crime_cube, spec['crimes'],
+                                   spec['states'], spec['years'], agg)
+    title = 'Total Crimes'
+
+    return encode_figure(graphs.create_time_series(
+        dfs, 'linear', 'total_crimes', title, 'rgb(142, 109, 37)', year_line,
+        agg))
 
 
 @app.callback(
-    dash.dependencies.Output('scatter2', 'figure'),
-    [dash.dependencies.Input('table', 'rows'),
-     dash.dependencies.Input('crime_checks', 'values'),
-     dash.dependencies.Input('crossfilter-variable2-column', 'value'),
-     dash.dependencies.Input('crossfilter-variable2-type', 'value')
-     ]
+    dash.dependencies.Output('filter-spec', 'children'),
+    [dash.dependencies.Input('crime_checks', 'values'),
+     dash.dependencies.Input('state_checks', 'value'),
+     dash.dependencies.Input('crossfilter-year-slider', 'value')],
+    [dash.dependencies.State('session-id', 'children')]
 )
-def update_scattter2(rows,
-                     crime_checks,
-                     variable2_column_name,
-                     variable2_type_name):
+@metrics.instrument
+def update_spec(crime_checks, state_checks, year_value, session_id=None):
+    '''Describe the current selection, the same size for any row count'''
+    version = versions.begin(session_id, 'update_spec')
+    spec = process.make_spec(crime_checks, state_checks, year_value)
 
-    dfs = pd.DataFrame(rows)
+    # A newer slider or dropdown value already has its own spec
+    if version is not None:
+        spec['version'] = versions.stamp()
+        if not versions.set_spec(version, spec['version']):
+            stop_if_superseded(update_spec, version)
 
-    dfs, state_abbrev = process.get_state(dfs)
+    # Warm the store so the dependent callbacks share the frame
+    get_crime_frame(spec['crimes'])
 
-    return graphs.create_scatter(dfs, variable2_column_name,
-                                 variable2_type_name, state_abbrev,
-                                 'rgb(84,39,143)')
+    return json.dumps(spec)
 
 
 @app.callback(
-    dash.dependencies.Output('x-time-series', 'figure'),
-    [dash.dependencies.Input('table', 'rows'),
+    [dash.dependencies.Output('crossfilter-state-map', 'figure'),
+     dash.dependencies.Output('scatter1', 'figure'),
+     dash.dependencies.Output('scatter2', 'figure'),
+     dash.dependencies.Output('x-time-series', 'figure'),
+     dash.dependencies.Output('y-time-series', 'figure'),
+     dash.dependencies.Output('time-series', 'figure')],
+    [dash.dependencies.Input('filter-spec', 'children'),
      dash.dependencies.Input('crossfilter-variable1-column', 'value'),
      dash.dependencies.Input('crossfilter-variable1-type', 'value'),
-     dash.dependencies.Input('crossfilter-variable1-agg', 'value')
-     ])
-def update_variable1_timeseries(rows,
-                                variable1_column_name,
-                                variable1_type_name,
-                                variable1_agg_name):
-
-    dfs = pd.DataFrame(rows)
+     dash.dependencies.Input('crossfilter-variable1-agg', 'value'),
+     dash.dependencies.Input('crossfilter-variable2-column', 'value'),
+     dash.dependencies.Input('crossfilter-variable2-type', 'value'),
+     dash.dependencies.Input('crossfilter-variable2-agg', 'value'),
+     dash.dependencies.Input('granularity', 'value'),
+     dash.dependencies.Input('year_line', 'value'),
+     dash.dependencies.Input('crossfilter-crimetype-agg', 'value'),
+     dash.dependencies.Input('model-family', 'value')
+     ],
+    [dash.dependencies.State('session-id', 'children')])
+@metrics.instrument
+def update_figures(jsonified_spec,
+                   variable1_column_name,
+                   variable1_type_name,
+                   variable1_agg_name,
+                   variable2_column_name,
+                   variable2_type_name,
+                   variable2_agg_name,
+                   granularity,
+                   year_line_value,
+                   crimetype_agg_name,
+                   model_family,
+                   session_id=None):
+    '''All the figures of an interaction in one pass, the spec rows and
+    yearly aggregates are computed once and shared, and the figures are
+    built concurrently. Unchanged figures come from the figure store.
+    Builds not started when a newer request arrives are skipped.'''
+    version = versions.begin(session_id, 'update_figures')
+    spec, spec_version = load_spec(jsonified_spec)
+    stop_if_superseded(update_figures, version, spec_version)
+
+    builds = [
+        (build_map, spec),
+        (build_scatter, spec, variable1_column_name, variable1_type_name,
+         None, model_family),
+        (build_scatter, spec, variable2_column_name, variable2_type_name,
+         'rgb(84,39,143)', model_family),
+        (build_variable_timeseries, spec, variable1_column_name,
+         variable1_type_name, variable1_agg_name, None, granularity),
+        (build_variable_timeseries, spec, variable2_column_name,
+         variable2_type_name, variable2_agg_name, 'rgb(84,39,143)',
+         granularity),
+        (build_crimetype_timeseries, spec, year_line_value,
+         crimetype_agg_name)
+    ]
+
+    futures = [figure_pool.submit(dataset.bind(
+        metrics.bind_stages(skip_if_superseded(version, build))), *args)
+        for build, *args in builds]
+    figures = [future.result() for future in futures]
+
+    stop_if_superseded(update_figures, version, spec_version)
+
+    return figures
 
-    dfs, state_abbrev = process.get_state(dfs)
 
-    dfs = dfs[['Year', variable1_column_name]]
-    title = '{}'.format(variable1_column_name)
-    return graphs.create_time_series(dfs, variable1_type_name,
-                                     variable1_column_name, title,
-                                     None, None, variable1_agg_name)
+@app.callback(
+    [dash.dependencies.Output('table', 'data'),
+     dash.dependencies.Output('table', 'selected_rows')],
+    [dash.dependencies.Input('filter-spec', 'children'),
+     dash.dependencies.Input('table', 'pagination_settings'),
+     dash.dependencies.Input('table', 'sorting_settings'),
+     dash.dependencies.Input('table', 'filtering_settings')],
+    [dash.dependencies.State('session-id', 'children')])
+@metrics.instrument
+def update_rows(jsonified_spec, pagination_settings, sorting_settings,
+                filtering_settings, session_id=None):
+    '''Only the current page of the sorted and filtered rows is sent, with
+    the rows of it selected in the session'''
+    version = versions.begin(session_id, 'update_rows')
+    spec, spec_version = load_spec(jsonified_spec)
+    stop_if_superseded(update_rows, version, spec_version)
+
+    dfs = resolve_spec(spec)
+    order = get_table_order(spec, dfs, sorting_settings, filtering_settings)
+    stop_if_superseded(update_rows, version, spec_version)
+
+    rows = process.get_table_page(dfs, order, pagination_settings,
+                                  process.get_crime_columns(spec['crimes']))
+
+    selected = selections.get(session_id, get_selection_key())
+    selected_rows = [i for i, row in enumerate(rows)
+                     if row['row_id'] in selected]
+
+    return rows, selected_rows
 
 
 @app.callback(
-    dash.dependencies.Output('y-time-series', 'figure'),
-    [dash.dependencies.Input('table', 'rows'),
-     dash.dependencies.Input('crossfilter-variable2-column', 'value'),
-     dash.dependencies.Input('crossfilter-variable2-type', 'value'),
-     dash.dependencies.Input('crossfilter-variable2-agg', 'value')
-     ])
-def update_variable2_timeseries(rows,
-                                variable2_column_name,
-                                variable2_type,
-                                variable2_agg_name):
+    dash.dependencies.Output('selected-rows', 'children'),
+    [dash.dependencies.Input('table', 'selected_rows')],
+    [dash.dependencies.State('table', 'data'),
+     dash.dependencies.State('session-id', 'children')])
+@metrics.instrument
+def update_selected_rows(selected_rows, rows, session_id=None):
+    '''Replace the selection of the session on the current page, keeping
+    the others'''
+    key = get_selection_key()
+    page = {row['row_id'] for row in rows or []}
+    selected = selections.get(session_id, key) - page
+    selected.update(rows[i]['row_id'] for i in selected_rows or [])
+    selections.put(session_id, key, selected)
 
-    dfs = pd.DataFrame(rows)
+    return len(selected)
 
-    dfs, state_abbrev = process.get_state(dfs)
 
-    dfs = dfs[['Year', variable2_column_name]]
-    title = '{}'.format(variable2_column_name)
-    return graphs.create_time_series(dfs, variable2_type,
-                                     variable2_column_name, title,
-                                     'rgb(84,39,143)', None, variable2_agg_name)
+@server.route('/cache-stats')
+def cache_stats():
+    '''Hits, misses and evictions of the server side caches'''
 
+    return flask.jsonify(cache.get_stats())
 
-@app.callback(
-    dash.dependencies.Output('table', 'rows'),
-    [dash.dependencies.Input('intermediate-value', 'children'),
-     dash.dependencies.Input('state_checks', 'value'),
-     dash.dependencies.Input('crossfilter-year-slider', 'value')])
-def update_rows(jsonified_update_df, state_checks, year_value):
 
-    dfs = pd.read_json(jsonified_update_df)
-    dfs = dfs.loc[(dfs['Year'] <= year_value[1]) & (dfs['Year'] >= year_value[0])]
-    dfs = process.get_state_dropdown(dfs, state_checks)
+@server.route('/data-status')
+def data_status():
+    '''Which load of the data is in use, and how long it took'''
+    data = get_dataset()
 
-    return dfs.to_dict('records')
+    return flask.jsonify(generation=data.generation, loaded=data.loaded,
+                         load_seconds=data.seconds, key=data.key,
+                         watching=watcher is not None,
+                         reload_errors=watcher.errors if watcher else 0)
 
 
-@app.callback(
-    dash.dependencies.Output('time-series', 'figure'),
-    [dash.dependencies.Input('table', 'rows'),
-     dash.dependencies.Input('year_line', 'value'),
-     dash.dependencies.Input('crossfilter-crimetype-agg', 'value')
-     ])
-def update_crimetype_timeseries(rows,
-                                year_line_value,
-                                crimetype_agg_name):
+@cache.memoize(query_results)
+def run_query(parsed):
+    '''Aggregate the rows of a parsed query, from the same stored frames
+    as the figures'''
+    import query
 
-    dfs = pd.DataFrame(rows)
-    title = 'Total Crimes'
+    if 'Month' in parsed['group_by']:
+        with metrics.timed('frame'):
+            dfs = process.get_spec_rows(get_dataset().month_df,
+                                        parsed['states'], parsed['years'])
+    else:
+        dfs = resolve_spec(process.make_spec(
+            parsed['crimes'], parsed['states'], parsed['years']))
+
+    with metrics.timed('frame'):
+        if parsed['filter']:
+            dfs = dfs[process.get_table_mask(dfs, parsed['filter'])]
+
+        return query.aggregate(dfs, parsed['group_by'], parsed['measures'],
+                               parsed['agg'])
+
+
+def get_choices():
+    '''The states and the first and last year of the loaded data'''
+    df = get_dataset().df
+
+    return (df.State_Abbrev.dropna().unique().tolist(),
+            [int(df.Year.min()), int(df.Year.max())])
+
+
+def parse_query(body):
+    '''A query with the states and years of the loaded data as defaults'''
+    import query
+
+    return query.parse_query(body, *get_choices())
+
+
+def query_data(**body):
+    '''The Python API of /api/query, for notebooks and jobs in the app's
+    process, e.g. query_data(group_by=['State'], measures=['TAVG'])'''
+
+    with dataset.pinned():
+        return run_query(parse_query(body)).copy()
+
+
+@server.route('/api/query', methods=['POST'])
+def api_query():
+    '''Grouped aggregates of the data, see query.py for the query'''
+    import query
 
-    return graphs.create_time_series(dfs, 'linear',
-                                     'total_crimes', title,
-                                     'rgb(142, 109, 37)', year_line_value,
-                                     crimetype_agg_name)
+    try:
+        parsed = parse_query(flask.request.get_json(force=True,
+                                                    silent=True))
+    except ValueError as error:
+        return flask.jsonify(error=str(error)), 400
+
+    return flask.jsonify(query.to_json(run_query(parsed)))
+
+
+@server.route('/export.<file_format>')
+def export_rows(file_format):
+    '''The rows of a filter spec as a CSV or Parquet download, see
+    export.parse_query for the query string'''
+    import export
+
+    if file_format not in export.get_formats():
+        return flask.jsonify(error='Unknown format {}'.format(
+            file_format)), 404
+
+    try:
+        parsed = export.parse_query(flask.request.args, *get_choices())
+    except ValueError as error:
+        return flask.jsonify(error=str(error)), 400
+
+    spec = process.make_spec(parsed['crimes'], parsed['states'],
+                             parsed['years'])
+    columns = export.get_columns(dict(parsed, crimes=spec['crimes']))
+    filename = 'crimes.{}'.format(file_format)
+    mimetype = export.MIMETYPES[file_format]
+
+    # The same data and query give the same file
+    etag = None
+    data_key = get_dataset().key
+    if data_key is not None:
+        etag = export.get_etag(data_key, spec, columns, parsed['filter'],
+                               file_format)
+        path = export.get_export_path('data', etag, file_format)
+
+        if os.path.exists(path):
+            return flask.send_file(os.path.abspath(path), mimetype,
+                                   as_attachment=True,
+                                   download_name=filename, etag=etag,
+                                   conditional=True)
+
+        if flask.request.if_none_match.contains(etag):
+            return flask.Response(status=304, headers={'ETag': '"{}"'.format(
+                etag)})
+
+    dfs = resolve_spec(spec)
+    if parsed['filter']:
+        dfs = dfs[process.get_table_mask(dfs, parsed['filter'])]
+
+    chunks = export.WRITERS[file_format](dfs, columns)
+    if etag is not None:
+        chunks = export.write_through(chunks, path)
+
+    response = flask.Response(chunks, mimetype=mimetype)
+    response.headers['Content-Disposition'] =\
+        'attachment; filename={}'.format(filename)
+    if etag is not None:
+        response.set_etag(etag)
+
+    return response
 
 
 app.css.append_css({
     "external_url": "https://cdn.rawgit.com/jkarakas/assets/4b97dd17/app.css"})
 
+metrics.record_startup('total', time.time() - import_start)
+server.logger.info('Started in %.3f s (%s)', time.time() - import_start,
+                   ', '.join('{} {:.3f} s'.format(stage, seconds) for
+                             stage, seconds in metrics.get_startup().items()))
+
 if __name__ == '__main__':
     app.run_server(debug=True)
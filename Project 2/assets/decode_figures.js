@@ -0,0 +1,72 @@
+/*
+ * Decode the compact figures sent by encoding.py before plotly draws them.
+ *
+ * Packed arrays {dtype, bdata, shape} become typed arrays (a list of rows
+ * when 2-D), label tables {labels, codes} become arrays of strings.
+ */
+(function () {
+    var TYPES = {
+        f8: Float64Array, f4: Float32Array,
+        i4: Int32Array, i2: Int16Array, i1: Int8Array,
+        u4: Uint32Array, u2: Uint16Array, u1: Uint8Array
+    };
+
+    function decodeArray(value) {
+        var bytes = atob(value.bdata);
+        var buffer = new Uint8Array(bytes.length);
+        for (var i = 0; i < bytes.length; i++) {
+            buffer[i] = bytes.charCodeAt(i);
+        }
+
+        var array = new TYPES[value.dtype](buffer.buffer);
+        if (!value.shape || value.shape.length < 2) {
+            return array;
+        }
+
+        var rows = [];
+        var columns = value.shape[1];
+        for (var row = 0; row < value.shape[0]; row++) {
+            rows.push(array.subarray(row * columns, (row + 1) * columns));
+        }
+        return rows;
+    }
+
+    function decode(value) {
+        if (!value || typeof value !== 'object' || Array.isArray(value)) {
+            return value;
+        }
+        if (value.bdata !== undefined) {
+            return decodeArray(value);
+        }
+        if (value.labels !== undefined && value.codes !== undefined) {
+            var codes = decodeArray(value.codes);
+            var labels = new Array(codes.length);
+            for (var i = 0; i < codes.length; i++) {
+                labels[i] = value.labels[codes[i]];
+            }
+            return labels;
+        }
+        return value;
+    }
+
+    function decodeData(data) {
+        (data || []).forEach(function (trace) {
+            Object.keys(trace).forEach(function (key) {
+                trace[key] = decode(trace[key]);
+            });
+        });
+    }
+
+    function wrap(plot) {
+        return function (gd, data) {
+            decodeData(Array.isArray(data) ? data : data && data.data);
+            return plot.apply(this, arguments);
+        };
+    }
+
+    if (window.Plotly && !window.Plotly.decodesFigures) {
+        window.Plotly.react = wrap(window.Plotly.react);
+        window.Plotly.newPlot = wrap(window.Plotly.newPlot);
+        window.Plotly.decodesFigures = true;
+    }
+})();
@@ -0,0 +1,99 @@
+'''Figure build time against row count, before and after the vectorized
+create_map and create_scatter.
+
+Run from the Project 2 directory:
+
+    python benchmarks/bench_graphs.py
+'''
+import os
+import sys
+import timeit
+
+import plotly.graph_objs as go
+from pandas.api.types import is_numeric_dtype
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import graphs  # noqa: E402
+import process  # noqa: E402
+from config import crime_types  # noqa: E402
+from synthetic import scale_states  # noqa: E402
+
+
+def legacy_create_map(dfm, crime_checks):
+    '''create_map as it was, string casting every column in place'''
+    for col in crime_checks:
+        dfm[col] = dfm[col].astype(int)
+
+    for col in dfm.columns:
+        dfm[col] = dfm[col].astype(str)
+
+    dfm['text'] = dfm['State'] + '<br>' + '<br>' +\
+        'Total Crimes: ' + dfm['total_crimes'] + '<br>' + '<br>'
+
+    for col in crime_checks:
+        dfm['text'] += col + ': ' + dfm[col] + '<br>'
+
+    return dict(data=[dict(type='choropleth',
+                           locations=dfm['State_Abbrev'],
+                           z=dfm['total_crimes'].astype(float),
+                           text=dfm['text'])])
+
+
+def legacy_create_scatter(dfs, variable, variable_type, state_abbrev, color):
+    '''create_scatter as it was, with per row hover strings'''
+    dfs = dfs[['State', 'Year', 'total_crimes', variable]]
+    dfs = dfs.loc[~(dfs == 0).any(axis=1)].dropna()
+
+    for col in dfs.columns:
+        if is_numeric_dtype(dfs[col]):
+            dfs[col] = dfs[col].round(2)
+        dfs[col] = dfs[col].astype(str)
+
+    dfs['text'] = 'State: ' + dfs['State'] + '<br>' +\
+        'Year: ' + dfs['Year'] + '<br>' +\
+        variable + ': ' + dfs[variable] + '<br>' +\
+        'Total Crimes: ' + dfs['total_crimes']
+
+    return {'data': [go.Scatter(x=dfs['total_crimes'], y=dfs[variable],
+                                mode='markers', text=dfs['text'],
+                                hoverinfo='text',
+                                marker={'color': color})]}
+
+
+def best_of(func, repeat=5):
+
+    return min(timeit.repeat(func, number=1, repeat=repeat)) * 1000
+
+
+def main(factors=(1, 10, 50, 100)):
+    df = process.get_data()
+    dfm = df.copy()
+    dfm['total_crimes'] = dfm[crime_types].sum(axis=1)
+    dfm = dfm.dropna(subset=['State_Abbrev'])
+
+    print('{:>8} {:>10} {:>12} {:>10} {:>12} {:>10}'.format(
+        'rows', 'map (ms)', 'legacy map', 'scatter', 'legacy scat',
+        'speedup'))
+
+    for factor in factors:
+        dfs = scale_states(dfm, factor)
+
+        # The map gets one row per state, scale that as well
+        dfg = dfs.groupby(['State_Abbrev', 'State']).sum().reset_index()
+
+        new_map = best_of(lambda: graphs.create_map(dfg, crime_types))
+        old_map = best_of(
+            lambda: legacy_create_map(dfg.copy(), crime_types))
+        new_scatter = best_of(lambda: graphs.create_scatter(
+            dfs, 'Gas_Per_Gallon', 'Linear', None, None))
+        old_scatter = best_of(lambda: legacy_create_scatter(
+            dfs, 'Gas_Per_Gallon', 'Linear', None, None))
+
+        print('{:>8} {:>10.2f} {:>12.2f} {:>10.2f} {:>12.2f} {:>9.1f}x'
+              .format(len(dfs), new_map, old_map, new_scatter, old_scatter,
+                      (old_map + old_scatter) / (new_map + new_scatter)))
+
+
+if __name__ == '__main__':
+    main()
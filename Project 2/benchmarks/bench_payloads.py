@@ -0,0 +1,74 @@
+'''Bytes on the wire of every figure, as plain JSON and with the arrays
+packed by encoding.py, before and after gzip, against row count.
+
+Run from the Project 2 directory:
+
+    python benchmarks/bench_payloads.py
+'''
+import gzip
+import json
+import os
+import sys
+import timeit
+
+import plotly
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import encoding  # noqa: E402
+import graphs  # noqa: E402
+import process  # noqa: E402
+from config import crime_types  # noqa: E402
+from synthetic import make_synthetic  # noqa: E402
+
+
+def to_json(fig):
+
+    return json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder).encode()
+
+
+def get_figures(dfs):
+    '''The figures of the dashboard for a frame with total_crimes'''
+    dfg = dfs.groupby(['State_Abbrev', 'State'], observed=True).sum()\
+        .reset_index()
+    dft = dfs.groupby('Year')[['total_crimes']].sum().reset_index()
+    dfv = dfs[['Year', 'Gas_Per_Gallon']]
+
+    return {
+        'map': graphs.create_map(dfg, crime_types),
+        'scatter': graphs.create_scatter(dfs, 'Gas_Per_Gallon', 'Linear',
+                                         None, None),
+        'variable series': graphs.create_time_series(
+            dfv, 'Linear', 'Gas_Per_Gallon', 'Gas_Per_Gallon', None, None,
+            'Avg'),
+        'crime series': graphs.create_time_series(
+            dft, 'linear', 'total_crimes', 'Total Crimes', None, None, 'Sum')
+    }
+
+
+def main(factors=(1, 10, 100)):
+    df = process.get_data()
+
+    print('{:>8} {:>16} {:>10} {:>10} {:>10} {:>10} {:>12}'.format(
+        'rows', 'figure', 'json', 'encoded', 'json gz', 'encoded gz',
+        'encode (ms)'))
+
+    for factor in factors:
+        dfs = make_synthetic(df, factor)
+        dfs['total_crimes'] = dfs[crime_types].sum(axis=1)
+
+        for name, fig in get_figures(dfs).items():
+            plain = to_json(fig)
+            packed = to_json(encoding.encode_figure(fig))
+            encode = min(timeit.repeat(
+                lambda: to_json(encoding.encode_figure(fig)), number=1,
+                repeat=5)) * 1000
+
+            print('{:>8} {:>16} {:>10} {:>10} {:>10} {:>10} {:>12.2f}'
+                  .format(len(dfs), name, len(plain), len(packed),
+                          len(gzip.compress(plain)),
+                          len(gzip.compress(packed)), encode))
+
+
+if __name__ == '__main__':
+    main()
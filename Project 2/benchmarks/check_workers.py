@@ -0,0 +1,216 @@
+'''Start the production server with several workers and check that they
+share the memory mapped dataset instead of each holding a copy: the
+memory only a worker maps (its Uss) grows by less than one copy of the
+data over many distinct selections.
+
+Run from the Project 2 directory (Linux only, reads /proc):
+
+    python benchmarks/check_workers.py --workers 4 --selections 32
+'''
+import argparse
+import csv
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import Request, urlopen
+
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+from config import crime_types  # noqa: E402
+
+
+def get_free_port():
+
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def get_children(pid):
+
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(entry)) as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (IOError, OSError):
+            continue
+        if ppid == pid:
+            children.append(int(entry))
+
+    return children
+
+
+def get_memory(pid):
+    '''Rss, Pss and Uss in kB of a whole process. Uss counts the pages
+    no other process maps, what the worker costs on top of the shared
+    data and libraries.'''
+    memory = {}
+
+    with open('/proc/{}/smaps_rollup'.format(pid)) as f:
+        for line in f:
+            fields = line.split()
+            if fields[0].endswith(':'):
+                memory[fields[0][:-1]] = int(fields[1])
+
+    return (memory['Rss'], memory['Pss'],
+            memory['Private_Clean'] + memory['Private_Dirty'])
+
+
+def get_dataset_size(project_dir=PROJECT_DIR):
+    '''kB of the column files of the yearly data, one copy of it'''
+    size = 0
+
+    for root, _, files in os.walk(os.path.join(project_dir, 'data',
+                                               '.columns', 'Year_df')):
+        size += sum(os.path.getsize(os.path.join(root, name))
+                    for name in files)
+
+    return size // 1024
+
+
+def post_callback(url, output, inputs, state=()):
+    '''The props of the response to one callback request'''
+    body = json.dumps({
+        'output': output,
+        'inputs': [{'id': id_, 'property': prop, 'value': value}
+                   for id_, prop, value in inputs],
+        'state': [{'id': id_, 'property': prop, 'value': value}
+                  for id_, prop, value in state]
+    }).encode()
+    request = Request(url + '/_dash-update-component', data=body,
+                      headers={'Content-Type': 'application/json'})
+
+    with urlopen(request, timeout=120) as response:
+        return json.loads(response.read().decode())['response']
+
+
+def select(url, crimes, states, years):
+    '''Make a filter spec and show the first page of its rows, as the
+    browser does on an edit'''
+    spec = post_callback(url, 'filter-spec.children', [
+        ('crime_checks', 'values', crimes),
+        ('state_checks', 'value', states),
+        ('crossfilter-year-slider', 'value', years)],
+        [('session-id', 'children', None)])['props']['children']
+
+    post_callback(url, '..table.data...table.selected_rows..', [
+        ('filter-spec', 'children', spec),
+        ('table', 'pagination_settings', {'current_page': 0,
+                                          'page_size': 25}),
+        ('table', 'sorting_settings', [{'column_id': 'total_crimes',
+                                        'direction': 'desc'}]),
+        ('table', 'filtering_settings', '')],
+        [('session-id', 'children', None)])
+
+
+def get_selections(n_selections, crime_types, states):
+    '''Distinct selections of crime types, states and years'''
+    rng = random.Random(0)
+
+    return [(rng.sample(crime_types, rng.randint(1, len(crime_types))),
+             rng.sample(states, rng.randint(1, len(states))),
+             sorted(rng.sample(range(1995, 2017), 2)))
+            for _ in range(n_selections)]
+
+
+def wait_until_up(url, timeout=60):
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urlopen(url, timeout=1)
+            return
+        except (IOError, OSError):
+            time.sleep(0.2)
+
+    raise RuntimeError('Server did not start')
+
+
+def get_states(project_dir=PROJECT_DIR):
+    '''The state abbreviations of the yearly data'''
+
+    with open(os.path.join(project_dir, 'data', 'Year_df.csv')) as f:
+        return sorted({row['State_Abbrev'] for row in csv.DictReader(f)
+                       if row['State_Abbrev']})
+
+
+def measure(n_workers, n_selections=32, project_dir=PROJECT_DIR):
+    '''Start the server in project_dir and make n_selections distinct
+    selections, each sent to every worker. Returns the Rss, Pss and Uss
+    of every worker before and after, and the kB of one copy of the
+    data.'''
+    port = get_free_port()
+    env = dict(os.environ, PORT=str(port), WEB_CONCURRENCY=str(n_workers))
+    env.pop('METRICS_DIR', None)
+
+    master = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+         'wsgi:server'], cwd=project_dir, env=env)
+
+    try:
+        url = 'http://127.0.0.1:{}'.format(port)
+        wait_until_up(url + '/')
+
+        warmup, *selections = get_selections(n_selections + 1, crime_types,
+                                             get_states(project_dir))
+
+        # Every request is sent from several threads at once so each
+        # worker gets its share
+        def run(selections):
+            with ThreadPoolExecutor(max_workers=n_workers * 2) as pool:
+                list(pool.map(lambda selection: select(url, *selection),
+                              [selection for selection in selections
+                               for _ in range(n_workers * 2)]))
+
+        # Let every worker finish importing the app and serve once
+        run([warmup])
+        workers = get_children(master.pid)
+        before = {pid: get_memory(pid) for pid in workers}
+
+        run(selections)
+        after = {pid: get_memory(pid) for pid in workers}
+
+        return before, after, get_dataset_size(project_dir)
+    finally:
+        master.send_signal(signal.SIGTERM)
+        master.wait()
+
+
+def main(n_workers, n_selections):
+    before, after, dataset = measure(n_workers, n_selections)
+
+    print('one copy of the data: {} kB'.format(dataset))
+    print('{:>8} {:>12} {:>12} {:>12} {:>12}'.format(
+        'worker', 'rss (kB)', 'pss (kB)', 'uss (kB)', 'growth (kB)'))
+
+    # A worker holding copies of the data grows by a copy per selection,
+    # one holding only what it adds to the shared data by much less
+    ok = len(before) == n_workers
+    for pid, (rss, pss, uss) in sorted(after.items()):
+        growth = uss - before[pid][2]
+        print('{:>8} {:>12} {:>12} {:>12} {:>12}'.format(
+            pid, rss, pss, uss, growth))
+        ok = ok and growth < dataset
+
+    print('bounded' if ok else 'NOT bounded')
+
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--selections', type=int, default=32)
+    args = parser.parse_args()
+    sys.exit(main(args.workers, args.selections))
@@ -0,0 +1,356 @@
+'''Replay dashboard sessions against the callback endpoint with many
+concurrent users, and report latency percentiles and throughput per
+callback.
+
+Each virtual user loads the page, then makes random edits the way an
+analyst would: toggling crime types, adding and removing states, dragging
+the year slider, changing the variables, paging, sorting and selecting
+table rows. A new filter spec fans out to the figures and the table rows
+at once, as the browser sends them.
+
+Run from the Project 2 directory, against gunicorn started here:
+
+    python benchmarks/load_test.py --users 200 --steps 20 --workers 4
+
+or against a server already running:
+
+    python benchmarks/load_test.py --url http://127.0.0.1:8050 --users 50
+'''
+import argparse
+import gzip
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import Request, urlopen
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import crime_types, variables, table_page_size  # noqa: E402
+from config import model_families  # noqa: E402
+from check_workers import PROJECT_DIR, get_free_port  # noqa: E402
+from check_workers import wait_until_up  # noqa: E402
+
+
+STATES = [
+    'AL', 'AK', 'AZ', 'AR', 'CA', 'CO', 'CT', 'DE', 'DC', 'FL', 'GA', 'HI',
+    'ID', 'IL', 'IN', 'IA', 'KS', 'KY', 'LA', 'ME', 'MD', 'MA', 'MI', 'MN',
+    'MS', 'MO', 'MT', 'NE', 'NV', 'NH', 'NJ', 'NM', 'NY', 'NC', 'ND', 'OH',
+    'OK', 'OR', 'PA', 'RI', 'SC', 'SD', 'TN', 'TX', 'UT', 'VT', 'VA', 'WA',
+    'WV', 'WI', 'WY']
+YEARS = list(range(1995, 2017))
+
+FIGURES = ['crossfilter-state-map', 'scatter1', 'scatter2', 'x-time-series',
+           'y-time-series', 'time-series']
+
+# The output ids of the callbacks, as the renderer sends them
+CALLBACKS = {
+    'update_spec': 'filter-spec.children',
+    'update_figures': '..' + '...'.join(
+        '{}.figure'.format(figure) for figure in FIGURES) + '..',
+    'update_rows': '..table.data...table.selected_rows..',
+    'update_selected_rows': 'selected-rows.children'
+}
+
+# Seconds between the releases of a slider drag
+DRAG_INTERVAL = 0.05
+
+
+class Recorder(object):
+    '''Latencies and errors per callback, shared by the users'''
+
+    def __init__(self):
+        self.latencies = {name: [] for name in CALLBACKS}
+        self.errors = {name: 0 for name in CALLBACKS}
+        self.superseded = {name: 0 for name in CALLBACKS}
+        self.bytes = {name: 0 for name in CALLBACKS}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, size, error, superseded=False):
+
+        with self._lock:
+            if error:
+                self.errors[name] += 1
+            elif superseded:
+                # Dropped by the server for a newer request, not timed
+                self.superseded[name] += 1
+            else:
+                self.latencies[name].append(seconds)
+                self.bytes[name] += size
+
+    def report(self, elapsed):
+
+        print('{:>22} {:>7} {:>6} {:>10} {:>9} {:>9} {:>9} {:>9} {:>10}'
+              .format('callback', 'calls', 'errors', 'superseded',
+                      'p50 (ms)', 'p95 (ms)', 'p99 (ms)', 'req/s',
+                      'kB/call'))
+
+        for name in CALLBACKS:
+            latencies = np.array(self.latencies[name]) * 1000
+            if not len(latencies):
+                continue
+
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            print('{:>22} {:>7} {:>6} {:>10} {:>9.1f} {:>9.1f} {:>9.1f} '
+                  '{:>9.1f} {:>10.1f}'.format(
+                      name, len(latencies), self.errors[name],
+                      self.superseded[name], p50, p95, p99,
+                      len(latencies) / elapsed,
+                      self.bytes[name] / len(latencies) / 1024))
+
+        total = sum(len(latencies) for latencies in self.latencies.values())
+        print('{} calls in {:.1f} s, {:.1f} req/s'.format(
+            total, elapsed, total / elapsed))
+
+
+class Session(object):
+    '''One analyst: the values of the inputs and the responses the
+    browser would hold'''
+
+    def __init__(self, url, recorder, rng, think):
+        self.url = url + '/_dash-update-component'
+        self.recorder = recorder
+        self.rng = rng
+        self.think = think
+        self.fanout = ThreadPoolExecutor(max_workers=4)
+
+        # The id the page was served with, requests of one page load are
+        # versioned together
+        self.session_id = uuid.uuid4().hex
+
+        self.crimes = list(crime_types)
+        self.states = list(STATES)
+        self.years = [1995, 2016]
+        self.variables = [variables[0], variables[1]]
+        self.types = ['Linear', 'Linear']
+        self.aggs = ['Avg', 'Avg']
+        self.family = 'None'
+        self.page = 0
+        self.sorting = []
+        self.spec = None
+        self.rows = []
+
+    def call(self, name, inputs, state=()):
+        '''POST one callback, returns the props of the response'''
+        body = json.dumps({
+            'output': CALLBACKS[name],
+            'inputs': [{'id': id_, 'property': prop, 'value': value}
+                       for id_, prop, value in inputs],
+            'state': [{'id': id_, 'property': prop, 'value': value}
+                      for id_, prop, value in state]
+        }).encode()
+        request = Request(self.url, data=body, headers={
+            'Content-Type': 'application/json',
+            'Accept-Encoding': 'gzip'})
+
+        start = time.time()
+        try:
+            with urlopen(request, timeout=120) as response:
+                data = response.read()
+                encoded = response.headers.get('Content-Encoding')
+                status = response.status
+        except (IOError, OSError):
+            self.recorder.record(name, 0, 0, True)
+            return None
+        seconds = time.time() - start
+
+        # No content, the server dropped the request for a newer one
+        if status == 204:
+            self.recorder.record(name, seconds, 0, False, True)
+            return None
+
+        self.recorder.record(name, seconds, len(data), False)
+        if encoded == 'gzip':
+            data = gzip.decompress(data)
+
+        return json.loads(data.decode())['response']
+
+    def update_spec(self, years=None):
+
+        response = self.call('update_spec', [
+            ('crime_checks', 'values', self.crimes),
+            ('state_checks', 'value', self.states),
+            ('crossfilter-year-slider', 'value', years or self.years)],
+            [('session-id', 'children', self.session_id)])
+        if response is None:
+            return
+
+        spec = self.spec = response['props']['children']
+
+        # The new spec fans out to both of its dependents
+        figures = self.fanout.submit(self.update_figures, spec)
+        self.update_rows(spec)
+        figures.result()
+
+    def update_figures(self, spec=None):
+
+        self.call('update_figures', [
+            ('filter-spec', 'children', spec or self.spec),
+            ('crossfilter-variable1-column', 'value', self.variables[0]),
+            ('crossfilter-variable1-type', 'value', self.types[0]),
+            ('crossfilter-variable1-agg', 'value', self.aggs[0]),
+            ('crossfilter-variable2-column', 'value', self.variables[1]),
+            ('crossfilter-variable2-type', 'value', self.types[1]),
+            ('crossfilter-variable2-agg', 'value', self.aggs[1]),
+            ('granularity', 'value', 'Year'),
+            ('year_line', 'value', None),
+            ('crossfilter-crimetype-agg', 'value', 'Avg'),
+            ('model-family', 'value', self.family)],
+            [('session-id', 'children', self.session_id)])
+
+    def update_rows(self, spec=None):
+
+        response = self.call('update_rows', [
+            ('filter-spec', 'children', spec or self.spec),
+            ('table', 'pagination_settings',
+             {'current_page': self.page, 'page_size': table_page_size}),
+            ('table', 'sorting_settings', self.sorting),
+            ('table', 'filtering_settings', '')],
+            [('session-id', 'children', self.session_id)])
+        if response is not None:
+            self.rows = response['table']['data']
+
+    def update_selected_rows(self):
+
+        if not self.rows:
+            return
+
+        picked = self.rng.sample(range(len(self.rows)),
+                                 min(3, len(self.rows)))
+        self.call('update_selected_rows', [
+            ('table', 'selected_rows', picked)],
+            [('table', 'data', self.rows),
+             ('session-id', 'children', self.session_id)])
+
+    def toggle_crime(self):
+
+        crime = self.rng.choice(crime_types)
+        if crime in self.crimes and len(self.crimes) > 1:
+            self.crimes.remove(crime)
+        elif crime not in self.crimes:
+            self.crimes.append(crime)
+        self.update_spec()
+
+    def edit_states(self):
+
+        if len(self.states) > 5 and self.rng.random() < 0.6:
+            self.states = self.rng.sample(self.states, len(self.states) - 5)
+        else:
+            self.states = sorted(set(self.states) |
+                                 set(self.rng.sample(STATES, 5)))
+        self.update_spec()
+
+    def drag_years(self):
+        '''A drag releases a few times on the way to the final range, the
+        browser sends each release without waiting for the last'''
+        start = self.rng.randrange(len(YEARS) - 1)
+        end = self.rng.randrange(start + 1, len(YEARS))
+        ranges = [[YEARS[max(0, start - step)], YEARS[end]]
+                  for step in range(self.rng.randint(1, 4))]
+
+        with ThreadPoolExecutor(max_workers=len(ranges)) as burst:
+            for years in ranges:
+                burst.submit(self.update_spec, years)
+                time.sleep(DRAG_INTERVAL)
+        self.years = ranges[-1]
+
+    def change_variable(self):
+
+        i = self.rng.randrange(2)
+        self.variables[i] = self.rng.choice(variables)
+        self.types[i] = self.rng.choice(['Linear', 'Log'])
+        self.aggs[i] = self.rng.choice(['Avg', 'Sum'])
+        if self.rng.random() < 0.2:
+            self.family = self.rng.choice(model_families)
+        self.update_figures()
+
+    def browse_table(self):
+
+        if self.rng.random() < 0.5:
+            self.page = self.rng.randrange(5)
+        else:
+            column = self.rng.choice(variables + crime_types)
+            self.sorting = [{'column_id': column, 'direction':
+                             self.rng.choice(['asc', 'desc'])}]
+            self.page = 0
+        self.update_rows()
+        self.update_selected_rows()
+
+    def run(self, steps):
+
+        actions = [self.toggle_crime, self.edit_states, self.drag_years,
+                   self.change_variable, self.browse_table]
+
+        try:
+            # The first page load
+            self.update_spec()
+            for _ in range(steps):
+                time.sleep(self.think * self.rng.random())
+                self.rng.choice(actions)()
+        finally:
+            self.fanout.shutdown()
+
+
+def start_server(n_workers):
+    '''gunicorn with the production settings on a free port'''
+    port = get_free_port()
+    env = dict(os.environ, PORT=str(port), WEB_CONCURRENCY=str(n_workers))
+
+    master = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+         'wsgi:server'], cwd=PROJECT_DIR, env=env)
+    url = 'http://127.0.0.1:{}'.format(port)
+    wait_until_up(url + '/')
+
+    return master, url
+
+
+def main(url, users, steps, think, seed):
+    recorder = Recorder()
+    rng = random.Random(seed)
+    sessions = [Session(url, recorder, random.Random(rng.random()), think)
+                for _ in range(users)]
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        for future in [pool.submit(session.run, steps)
+                       for session in sessions]:
+            future.result()
+
+    recorder.report(time.time() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', help='a running server, otherwise gunicorn '
+                        'is started here')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='gunicorn workers when starting the server')
+    parser.add_argument('--users', type=int, default=20,
+                        help='concurrent sessions')
+    parser.add_argument('--steps', type=int, default=10,
+                        help='edits per session after the page load')
+    parser.add_argument('--think', type=float, default=1.,
+                        help='most seconds a user waits between edits')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    master = None
+    url = args.url
+    if url is None:
+        master, url = start_server(args.workers)
+
+    try:
+        main(url.rstrip('/'), args.users, args.steps, args.think, args.seed)
+    finally:
+        if master is not None:
+            master.send_signal(signal.SIGTERM)
+            master.wait()
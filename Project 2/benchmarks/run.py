@@ -0,0 +1,189 @@
+'''Time the dashboard callbacks and figure builders on synthetic data.
+
+Each function is timed in isolation with the caches cleared, and its peak
+traced memory recorded, at several multiples of the real row count.
+Results are saved as JSON and can be compared with a saved baseline:
+
+    python benchmarks/run.py --factors 10 100 --output results.json
+    python benchmarks/run.py --factors 10 100 --baseline results.json \
+        --threshold 1.5
+
+The run fails (exit code 1) when a function is slower than its baseline
+time times the threshold.
+'''
+import argparse
+import json
+import os
+import sys
+import time
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+import cache  # noqa: E402
+import cube  # noqa: E402
+import graphs  # noqa: E402
+import process  # noqa: E402
+from config import crime_types, variables  # noqa: E402
+from synthetic import make_synthetic  # noqa: E402
+
+
+def get_cases(dfs):
+    '''Name and zero argument function for everything that is timed'''
+    spec = process.make_spec(crime_types, dfs.State_Abbrev.dropna().unique(),
+                             [int(dfs.Year.min()), int(dfs.Year.max())])
+    jsonified_spec = json.dumps(spec)
+
+    dfm = app.resolve_spec(spec)
+    crime_cube = app.get_dataset().crime_cube
+    dfg = cube.get_state_totals(crime_cube, spec['crimes'],
+                                spec['states'], spec['years'])
+
+    return [
+        ('update_spec', lambda: app.update_spec(
+            crime_types, spec['states'], spec['years'])),
+        ('update_rows', lambda: app.update_rows(
+            jsonified_spec, {'current_page': 0, 'page_size': 50}, [], '',
+            '[]')),
+        ('update_rows (sorted page)', lambda: app.update_rows(
+            jsonified_spec, {'current_page': 3, 'page_size': 50},
+            [{'column_id': 'total_crimes', 'direction': 'desc'}],
+            '"Year" > 2000', '[]')),
+        ('update_figures', lambda: app.update_figures(
+            jsonified_spec, variables[0], 'Linear', 'Avg', variables[1],
+            'Log', 'Sum', 'Year', 2000, 'Avg', 'None')),
+        ('update_figures (month)', lambda: app.update_figures(
+            jsonified_spec, 'TAVG', 'Linear', 'Avg', variables[1], 'Log',
+            'Sum', 'Month', 2000, 'Avg', 'None')),
+        ('build_map', lambda: app.build_map(spec)),
+        ('build_scatter', lambda: app.build_scatter(
+            spec, variables[0], 'Linear', None)),
+        ('build_scatter (negative binomial)', lambda: app.build_scatter(
+            spec, variables[0], 'Linear', None, 'Negative Binomial')),
+        ('fit_models', lambda: app.fit_models(
+            spec, variables[0], 'Negative Binomial')),
+        ('build_variable_timeseries', lambda: app.build_variable_timeseries(
+            spec, variables[0], 'Linear', 'Avg', None, 'Year')),
+        ('build_variable_timeseries (month)',
+         lambda: app.build_variable_timeseries(
+             spec, 'TAVG', 'Linear', 'Avg', None, 'Month')),
+        ('build_crimetype_timeseries',
+         lambda: app.build_crimetype_timeseries(spec, 2000, 'Avg')),
+        ('query_data (state x year)', lambda: app.query_data(
+            group_by=['State', 'Year'],
+            measures=[variables[0], 'total_crimes'], agg='mean')),
+        ('build_cube', lambda: cube.build_cube(dfs)),
+        ('get_crime_frame', lambda: process.get_crime_frame(
+            dfs, crime_types, crime_cube)),
+        ('graphs.create_map', lambda: graphs.create_map(dfg, crime_types)),
+        ('graphs.create_scatter', lambda: graphs.create_scatter(
+            dfm, variables[0], 'Linear', None, None)),
+        ('graphs.create_time_series', lambda: graphs.create_time_series(
+            dfm[['Year', variables[0]]], 'Linear', variables[0],
+            variables[0], None, None, 'Avg')),
+    ]
+
+
+def cold(func):
+    '''Run func with every cache cleared, so nothing is memoized'''
+
+    def run():
+        cache.clear_all()
+        return func()
+
+    return run
+
+
+def measure(func, repeat):
+
+    ms = min(timeit.repeat(cold(func), number=1, repeat=repeat)) * 1000
+
+    tracemalloc.start()
+    result = cold(func)()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    size = len(result) if isinstance(result, str) else None
+
+    return {'ms': ms, 'peak_kb': peak / 1024., 'response_bytes': size}
+
+
+def run(factors, unit, repeat):
+    df = process.get_data()
+    results = {'unit': unit, 'time': time.time(), 'factors': {}}
+
+    for factor in factors:
+        dfs = make_synthetic(df, factor, unit)
+        app.load_data(dfs)
+
+        timings = {}
+        for name, func in get_cases(dfs):
+            timings[name] = measure(func, repeat)
+            print('{:>6}x {:>9} rows {:<30} {:>10.2f} ms {:>10.0f} kB'.format(
+                factor, len(dfs), name, timings[name]['ms'],
+                timings[name]['peak_kb']))
+
+        results['factors'][str(factor)] = {'rows': len(dfs),
+                                           'timings': timings}
+
+    app.load_data()
+
+    return results
+
+
+def find_regressions(results, baseline, threshold):
+    '''Functions slower than threshold times their baseline time'''
+    regressions = []
+
+    for factor, entry in results['factors'].items():
+        base_entry = baseline['factors'].get(factor)
+        if base_entry is None:
+            continue
+
+        for name, timing in entry['timings'].items():
+            base_timing = base_entry['timings'].get(name)
+            if base_timing and timing['ms'] > base_timing['ms'] * threshold:
+                regressions.append((factor, name, base_timing['ms'],
+                                    timing['ms']))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--factors', type=int, nargs='+',
+                        default=[10, 100, 1000])
+    parser.add_argument('--unit', choices=['states', 'counties', 'months'],
+                        default='states')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='JSON file for the results')
+    parser.add_argument('--baseline', help='JSON results to compare with')
+    parser.add_argument('--threshold', type=float, default=1.5)
+    args = parser.parse_args()
+
+    results = run(args.factors, args.unit, args.repeat)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        regressions = find_regressions(results, baseline, args.threshold)
+        for factor, name, before, after in regressions:
+            print('REGRESSION {}x {}: {:.2f} ms -> {:.2f} ms'.format(
+                factor, name, before, after))
+
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
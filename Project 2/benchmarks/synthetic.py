@@ -0,0 +1,66 @@
+'''Synthetic Year_df shaped data at a multiple of the real row count'''
+import numpy as np
+import pandas as pd
+
+import storage
+from config import crime_types, crime_types_original, variables
+from config import column_dtypes
+
+
+def scale_states(df, factor, county=False):
+    '''Repeat the frame with renamed states (or counties of the same
+    states) to get factor times the rows'''
+    copies = []
+    for i in range(factor):
+        # Categorical states get new categories, renamed as strings
+        dfc = df.astype({'State': object, 'State_Abbrev': object})
+        if i:
+            dfc['State'] = dfc['State'] + (' County {}' if county
+                                           else ' {}').format(i)
+            if not county:
+                dfc['State_Abbrev'] = dfc['State_Abbrev'] + str(i)
+        copies.append(dfc)
+
+    return pd.concat(copies, ignore_index=True)
+
+
+def scale_months(df, months=12):
+    '''Repeat every row once per month'''
+    dfm = df.loc[df.index.repeat(months)].reset_index(drop=True)
+    dfm.insert(1, 'Month', np.tile(np.arange(1, months + 1), len(df)))
+
+    return dfm
+
+
+def add_noise(df, seed=0):
+    '''Jitter the measures so repeated rows are not identical'''
+    rng = np.random.RandomState(seed)
+    df = df.copy()
+
+    for col in variables + crime_types:
+        noise = rng.uniform(0.9, 1.1, len(df))
+        counts = df[col].dtype.kind in 'iu'
+        df[col] = df[col] * noise
+
+        # Counts stay whole numbers
+        if counts or col in crime_types:
+            df[col] = df[col].round()
+
+    return df
+
+
+def make_synthetic(df, factor, unit='states', seed=0):
+    '''factor times the rows of df, added as more states, more counties
+    per state or monthly rows (factor is then rounded to 12 x states)'''
+
+    if unit == 'months':
+        dfs = scale_months(scale_states(df, max(1, factor // 12)))
+    else:
+        dfs = scale_states(df, factor, county=unit == 'counties')
+
+    # With the dtypes of the loaded data, where the crimes are renamed
+    dtypes = dict(column_dtypes)
+    dtypes.update({cr: column_dtypes[original] for original, cr
+                   in zip(crime_types_original, crime_types)})
+
+    return storage.apply_dtypes(add_noise(dfs, seed), dtypes)
@@ -0,0 +1,171 @@
+import functools
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+# Every named cache, so they can be reported on and cleared together
+caches = OrderedDict()
+
+_missing = object()
+
+# Returns the namespace every key is made in, see set_namespace
+_namespace = None
+
+
+class LRUCache(object):
+    '''A bounded, thread safe mapping that evicts the least recently
+    used entry once maxsize is reached, and optionally entries older
+    than ttl seconds'''
+
+    def __init__(self, maxsize=32, ttl=None, name=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+        if name is not None:
+            caches[name] = self
+
+    def get(self, key, default=None):
+
+        with self._lock:
+            try:
+                value, expires = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+
+            if expires is not None and expires < time.time():
+                self.misses += 1
+                self.evictions += 1
+                return default
+
+            # Re-insert to mark as most recently used
+            self._data[key] = (value, expires)
+            self.hits += 1
+
+            return value
+
+    def put(self, key, value):
+
+        expires = None if self.ttl is None else time.time() + self.ttl
+
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expires)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'size': len(self._data),
+                    'maxsize': self.maxsize}
+
+    def __contains__(self, key):
+
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+
+        with self._lock:
+            return len(self._data)
+
+
+def set_namespace(get_namespace):
+    '''Make every key within get_namespace(), such as the generation of
+    the data, so values computed from different data never share a key'''
+    global _namespace
+
+    _namespace = get_namespace
+
+
+def make_key(*args):
+    '''Short, stable token for a json serializable set of arguments'''
+
+    if _namespace is not None:
+        args = (_namespace(),) + args
+
+    payload = json.dumps(args, sort_keys=True, default=str)
+
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def memoize(lru_cache):
+    '''Cache the results of a function by a canonical hash of its
+    arguments, which must be json serializable.
+
+    Concurrent calls with the same arguments are coalesced, the first
+    computes the value and the others wait for it.'''
+
+    def decorator(func):
+        # key: Event set once the call computing it finishes
+        running = {}
+        lock = threading.Lock()
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = make_key(func.__name__, args, kwargs)
+
+            value = lru_cache.get(key, _missing)
+            if value is not _missing:
+                return value
+
+            with lock:
+                done = running.get(key)
+                if done is None:
+                    done = running[key] = threading.Event()
+                    first = True
+                else:
+                    first = False
+
+            if not first:
+                done.wait()
+                value = lru_cache.get(key, _missing)
+                # The first call failed, or the value is already evicted
+                if value is _missing:
+                    value = func(*args, **kwargs)
+                return value
+
+            try:
+                value = func(*args, **kwargs)
+                lru_cache.put(key, value)
+            finally:
+                with lock:
+                    del running[key]
+                done.set()
+
+            return value
+
+        return wrapper
+
+    return decorator
+
+
+def get_stats():
+
+    return {name: lru_cache.stats() for name, lru_cache in caches.items()}
+
+
+def clear_all():
+    '''Drop every cached value, for when the data is reloaded'''
+
+    for lru_cache in caches.values():
+        lru_cache.clear()
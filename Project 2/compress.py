@@ -0,0 +1,79 @@
+'''Compress the responses of the server, with brotli when the package is
+installed and the browser accepts it and with gzip otherwise'''
+import gzip
+import hashlib
+
+import flask
+
+import cache
+
+from config import compress_min_bytes, compress_level
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+COMPRESSIBLE = ['application/json', 'application/javascript', 'text/html',
+                'text/css', 'text/plain', 'text/csv']
+
+# The static bundles (plotly.js is 3 MB) are compressed once. Only they
+# are cached, other responses such as the layout differ on every load.
+STATIC_PATH = '/_dash-component-suites/'
+compressed = cache.LRUCache(maxsize=32, name='compressed')
+
+
+def get_encoding(accept_encoding):
+    '''The best encoding the browser accepts, None for none'''
+
+    if brotli is not None and 'br' in accept_encoding:
+        return 'br'
+    if 'gzip' in accept_encoding:
+        return 'gzip'
+
+    return None
+
+
+def compress(data, encoding):
+
+    if encoding == 'br':
+        return brotli.compress(data, quality=compress_level)
+
+    return gzip.compress(data, compresslevel=compress_level)
+
+
+def compress_response(response):
+    '''Compress a complete, successful response of a text type'''
+
+    if response.direct_passthrough or response.is_streamed or\
+            response.status_code != 200 or\
+            'Content-Encoding' in response.headers or\
+            response.mimetype.lower() not in COMPRESSIBLE:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = get_encoding(flask.request.headers.get('Accept-Encoding', ''))
+    data = response.get_data()
+
+    if encoding is None or len(data) < compress_min_bytes:
+        return response
+
+    if flask.request.method == 'GET' and STATIC_PATH in flask.request.path:
+        key = (hashlib.sha1(data).hexdigest(), encoding)
+        body = compressed.get(key)
+        if body is None:
+            body = compress(data, encoding)
+            compressed.put(key, body)
+    else:
+        body = compress(data, encoding)
+
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+
+    return response
+
+
+def init_app(server):
+    '''Compress the responses of the server'''
+    server.after_request(compress_response)
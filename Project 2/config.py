@@ -22,6 +22,19 @@ variables = [
     'SPI',
     'Population']
 
+# The variables that are also observed monthly, in Month_df.csv
+monthly_variables = [
+    'TAVG',
+    'TMIN',
+    'TMAX',
+    'INJURIES_DIRECT',
+    'INJURIES_INDIRECT',
+    'DEATHS_DIRECT',
+    'DEATHS_INDIRECT',
+    'DAMAGE_PROPERTY',
+    'DAMAGE_CROPS',
+    'SPI']
+
 crime_types_original = [
     'violent_crime',
     'homicide',
@@ -33,6 +46,80 @@ crime_types_original = [
     'larceny',
     'motor_vehicle_theft']
 
+# The dtype of every column of the data files, enforced when they are
+# loaded. Counts are nullable integers, measures with a few significant
+# digits float32 and the repeated strings categorical.
+column_dtypes = {
+    'Year': 'int16',
+    'Month': 'int8',
+    'Date': 'category',
+    'State': 'category',
+    'State_Abbrev': 'category',
+    'Gas_Per_Gallon': 'float32',
+    'MENTHLTH': 'float32',
+    'PHYSHLTH': 'float32',
+    'Median_Income': 'float32',
+    'TAVG': 'float32',
+    'TMIN': 'float32',
+    'TMAX': 'float32',
+    'INJURIES_DIRECT': 'Int32',
+    'INJURIES_INDIRECT': 'Int32',
+    'DEATHS_DIRECT': 'Int32',
+    'DEATHS_INDIRECT': 'Int32',
+    'DAMAGE_PROPERTY': 'Int64',
+    'DAMAGE_CROPS': 'Int64',
+    'SPI': 'float32',
+    'Population': 'Int32'}
+column_dtypes.update({cr: 'Int32' for cr in crime_types_original})
+
 # Make crime types human readable
 crime_types = [' '.join(cr.split('_')).title() for cr in
                crime_types_original]
+
+# Time series longer than this are downsampled on the server
+max_time_series_points = 500
+
+# Scatter plots with more points are drawn with WebGL, and past the second
+# limit as a density of points binned on the server
+max_scatter_points = 2000
+max_webgl_points = 100000
+scatter_bins = 60
+
+# Rows per page of the data table
+table_page_size = 50
+
+# Threads building the figures of one interaction concurrently
+figure_threads = 6
+
+# The count models fitted over the scatter plots, the negative binomial
+# alpha is fixed as in statsmodels
+model_families = ['None', 'Poisson', 'Negative Binomial']
+nb_alpha = 1.0
+model_max_iterations = 100
+model_tolerance = 1e-8
+
+# Figures are sent with their arrays packed as base64 typed arrays, decoded
+# by assets/decode_figures.js, arrays shorter than the minimum stay lists
+binary_figures = True
+binary_min_length = 8
+
+# Responses smaller than this are not compressed
+compress_min_bytes = 500
+compress_level = 6
+
+# Browser sessions whose latest request versions are remembered, requests
+# superseded by a newer one from the same session are dropped
+max_sessions = 10000
+
+# Rows written per chunk of a streamed export, and finished exports kept
+# on disk for repeated downloads
+export_chunk_rows = 10000
+max_exports = 20
+
+# Seconds between checks of the data files for a new version, which is
+# loaded and swapped in while the app serves, 0 to never reload
+reload_interval = 10
+
+# Seconds between writes of a worker's metrics to METRICS_DIR, which is
+# also written on a scrape of /metrics and when the worker exits
+metrics_flush_interval = 5
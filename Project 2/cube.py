@@ -0,0 +1,124 @@
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from config import crime_types
+
+
+# Crime counts summed into a dense State x Year x Crime Type array, totals
+# for any selection are a masked reduction over the cube instead of a
+# group by over the rows.
+# The *_prefix arrays hold cumulative sums over the years with a leading
+# zero, so the total of a year range is two lookups per state.
+Cube = namedtuple('Cube', ['states', 'abbrevs', 'years', 'crimes',
+                           'values', 'counts', 'row_state', 'row_year',
+                           'crime_prefix', 'count_prefix'])
+
+
+def get_prefix(values):
+    '''Cumulative sums over the year axis, starting from zero'''
+    prefix = np.zeros((values.shape[0], values.shape[1] + 1) +
+                      values.shape[2:], dtype=values.dtype)
+    np.cumsum(values, axis=1, out=prefix[:, 1:])
+
+    return prefix
+
+
+def build_cube(df, crimes=crime_types):
+    ''''''
+    states, row_state = np.unique(df['State'].values.astype(str),
+                                  return_inverse=True)
+    years, row_year = np.unique(df['Year'].values, return_inverse=True)
+
+    # Abbreviation of each state, NaN for the national and D.C. rows
+    abbrevs = np.empty(len(states), dtype=object)
+    abbrevs[row_state] = df['State_Abbrev'].values
+
+    # Missing counts add nothing, the same as a pandas sum
+    crime_values = np.nan_to_num(df[crimes].to_numpy(float,
+                                                     na_value=np.nan))
+
+    values = np.zeros((len(states), len(years), len(crimes)))
+    np.add.at(values, (row_state, row_year), crime_values)
+
+    # Number of rows behind each cell, for the averages
+    counts = np.zeros((len(states), len(years)), dtype=int)
+    np.add.at(counts, (row_state, row_year), 1)
+
+    return Cube(states, abbrevs, years, list(crimes), values, counts,
+                row_state, row_year, get_prefix(values), get_prefix(counts))
+
+
+def get_year_range(cube, year_value):
+    '''Positions of a year range in the prefix arrays'''
+    lo = np.searchsorted(cube.years, year_value[0], side='left')
+    hi = np.searchsorted(cube.years, year_value[1], side='right')
+
+    return lo, max(lo, hi)
+
+
+def get_selection(cube, crime_checks, state_checks, year_value):
+    '''Boolean state and year masks and the crime positions'''
+    state_mask = pd.Series(cube.abbrevs).isin(state_checks).values
+    year_mask = (cube.years >= year_value[0]) &\
+        (cube.years <= year_value[1])
+    crime_idx = [cube.crimes.index(cr) for cr in crime_checks]
+
+    return state_mask, year_mask, crime_idx
+
+
+def get_row_totals(cube, crime_checks):
+    '''Total of the selected crimes for every row of the source frame'''
+    crime_idx = [cube.crimes.index(cr) for cr in crime_checks]
+    totals = cube.values[:, :, crime_idx].sum(axis=2)
+
+    return totals[cube.row_state, cube.row_year]
+
+
+def get_state_totals(cube, crime_checks, state_checks, year_value):
+    '''Per state sums of each selected crime and their total, from the
+    prefix sums over the years'''
+    state_mask, _, crime_idx = get_selection(
+        cube, crime_checks, state_checks, year_value)
+
+    lo, hi = get_year_range(cube, year_value)
+
+    sums = cube.crime_prefix[state_mask, hi] -\
+        cube.crime_prefix[state_mask, lo]
+    counts = cube.count_prefix[state_mask, hi] -\
+        cube.count_prefix[state_mask, lo]
+
+    # Only mappable states that have rows in the year range
+    present = (counts > 0) & pd.notnull(cube.abbrevs[state_mask])
+    sums = sums[:, crime_idx][present]
+
+    dfm = pd.DataFrame(sums, columns=crime_checks)
+    dfm.insert(0, 'State', cube.states[state_mask][present])
+    dfm.insert(0, 'State_Abbrev', cube.abbrevs[state_mask][present])
+    dfm['total_crimes'] = sums.sum(axis=1)
+
+    # Same order as a group by on the abbreviation
+    return dfm.sort_values('State_Abbrev').reset_index(drop=True)
+
+
+def get_year_totals(cube, crime_checks, state_checks, year_value, agg):
+    '''Total crimes per year, summed or averaged over the states'''
+    state_mask, year_mask, crime_idx = get_selection(
+        cube, crime_checks, state_checks, year_value)
+
+    values = cube.values[state_mask][:, year_mask][:, :, crime_idx]
+    counts = cube.counts[state_mask][:, year_mask].sum(axis=0)
+
+    totals = values.sum(axis=(0, 2))
+
+    # Only the years that have rows for the selected states
+    present = counts > 0
+    totals = totals[present]
+
+    if agg != 'Sum':
+        totals = totals / counts[present]
+
+    return pd.DataFrame({'Year': cube.years[year_mask][present],
+                         'total_crimes': totals})
+
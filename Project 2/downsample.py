@@ -0,0 +1,53 @@
+import numpy as np
+
+
+def lttb(x, y, n_out):
+    '''Indices of n_out points that keep the visual shape of a series,
+    using Largest Triangle Three Buckets. x must be sorted and numeric.'''
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # The first and last points are kept, the rest are split in buckets
+    every = (n - 2) / float(n_out - 2)
+    edges = (np.arange(n_out - 1) * every).astype(int) + 1
+    edges[-1] = n - 1
+
+    indices = np.empty(n_out, dtype=int)
+    indices[0] = 0
+    indices[-1] = n - 1
+
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+
+        # Average of the next bucket, or the last point
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+
+        # Keep the point making the largest triangle with the previous
+        # kept point and the next bucket's average
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) -
+                      (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        indices[i + 1] = a
+
+    return indices
+
+
+def downsample(dfs, x_column, y_column, n_out):
+    '''Rows of dfs reduced to about n_out points along x_column, missing
+    values are dropped first'''
+    dfs = dfs[dfs[y_column].notnull()]
+
+    if len(dfs) <= n_out:
+        return dfs
+
+    # Positions rather than x, the points are about evenly spaced in time
+    indices = lttb(np.arange(len(dfs)), dfs[y_column].values, n_out)
+
+    return dfs.iloc[indices]
@@ -0,0 +1,124 @@
+'''Compact figure payloads.
+
+Numeric arrays of the traces are sent as base64 packed typed arrays,
+{'dtype': 'f8', 'bdata': ..., 'shape': [rows, columns]}, and repeated
+labels as a table of the distinct labels with a packed array of codes,
+{'labels': [...], 'codes': {...}}. assets/decode_figures.js turns both
+back into arrays before plotly draws the figure.
+'''
+import base64
+
+import numpy as np
+import pandas as pd
+
+from config import binary_min_length
+
+
+# The integer types plotly.js has typed arrays for, smallest first
+INTEGER_TYPES = [np.int8, np.uint8, np.int16, np.uint16, np.int32,
+                 np.uint32]
+
+# The keys of a trace holding per point arrays
+ARRAY_KEYS = ['x', 'y', 'z', 'customdata', 'text', 'locations']
+
+
+def get_integer_type(values):
+    '''The smallest integer type holding every value, None if too large'''
+    low, high = values.min(), values.max()
+
+    for int_type in INTEGER_TYPES:
+        info = np.iinfo(int_type)
+        if info.min <= low and high <= info.max:
+            return int_type
+
+    return None
+
+
+def encode_array(values):
+    '''A numeric array as a packed typed array, None when it is not one'''
+    if values.dtype.kind == 'f' and values.size and\
+            np.isfinite(values).all() and (values == np.rint(values)).all():
+        # Counts held as floats pack as the integers they are
+        int_type = get_integer_type(values)
+        if int_type is not None:
+            values = values.astype(int_type)
+
+    if values.dtype.kind == 'f':
+        # float16 has no typed array, float64 halves when float32 holds
+        # every value exactly (NaN included)
+        single = values.astype(np.float32)
+        if values.dtype.itemsize <= 4 or\
+                np.array_equal(single, values, equal_nan=True):
+            values = single
+        else:
+            values = values.astype(np.float64)
+    elif values.dtype.kind in 'iub':
+        int_type = get_integer_type(values) if len(values) else np.int8
+        if int_type is None:
+            values = values.astype(np.float64)
+        else:
+            values = values.astype(int_type)
+    else:
+        return None
+
+    # Typed arrays are read in the byte order of the browser, little
+    # endian everywhere in practice
+    values = np.ascontiguousarray(values, values.dtype.newbyteorder('<'))
+
+    encoded = {
+        'dtype': values.dtype.kind + str(values.dtype.itemsize),
+        'bdata': base64.b64encode(values.tobytes()).decode('ascii')
+    }
+    if values.ndim > 1:
+        encoded['shape'] = list(values.shape)
+
+    return encoded
+
+
+def encode_labels(values):
+    '''Strings as a table of the distinct ones and their codes, None when
+    nothing repeats'''
+    codes, labels = pd.factorize(values)
+
+    if len(labels) == len(values) or (codes < 0).any():
+        return None
+
+    return {'labels': labels.tolist(), 'codes': encode_array(codes)}
+
+
+def encode_values(values):
+    '''The compact form of a trace array, or the array itself'''
+    if isinstance(values, (pd.Series, pd.Index)):
+        values = values.to_numpy()
+
+    if not isinstance(values, np.ndarray) or values.size < binary_min_length:
+        return values
+
+    if values.dtype == object:
+        if values.ndim == 1:
+            return encode_labels(values) or values
+
+        # Mixed columns, such as customdata of several counts
+        try:
+            values = values.astype(float)
+        except (TypeError, ValueError):
+            return values
+
+    return encode_array(values) or values
+
+
+def encode_figure(fig):
+    '''The figure with the arrays of every trace encoded'''
+    data = []
+
+    for trace in fig['data']:
+        if hasattr(trace, 'to_plotly_json'):
+            trace = trace.to_plotly_json()
+
+        trace = dict(trace)
+        for key in ARRAY_KEYS:
+            if key in trace:
+                trace[key] = encode_values(trace[key])
+        data.append(trace)
+
+    return dict(fig, data=data)
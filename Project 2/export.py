@@ -0,0 +1,244 @@
+'''Downloads of the filtered rows as CSV, or Parquet when pyarrow is
+installed.
+
+The file is produced a chunk of rows at a time and streamed while it is
+written, so the whole output is never held in memory. A finished export
+is kept on disk under its ETag, and repeated downloads are served from
+that file with a Content-Length, byte ranges and conditional requests.
+'''
+import hashlib
+import json
+import os
+import threading
+
+from config import crime_types, variables, base_columns
+from config import export_chunk_rows, max_exports
+from process import parse_table_filter, get_crime_columns
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+EXPORT_DIR = '.exports'
+
+MIMETYPES = {
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet'
+}
+
+
+def get_formats():
+    '''The export formats available with the installed packages'''
+
+    return ['csv', 'parquet'] if pyarrow is not None else ['csv']
+
+
+def check_names(chosen, names, what):
+
+    unknown = [name for name in chosen if name not in names]
+    if unknown:
+        raise ValueError('Unknown {}: {}'.format(what, ', '.join(
+            str(name) for name in unknown)))
+
+    return chosen
+
+
+def split_names(value, names, what):
+    '''Comma separated names checked against the known ones, all of them
+    when missing'''
+
+    if not value:
+        return list(names)
+
+    return check_names([name.strip() for name in value.split(',')
+                        if name.strip()], names, what)
+
+
+def check_list(value, names, what):
+    '''A list of known names'''
+
+    if not isinstance(value, list):
+        raise ValueError('{} is not a list'.format(what))
+
+    return check_names(value, names, what)
+
+
+def check_years(value, years):
+    '''[first, last] as ints within the first and last year of the
+    data'''
+
+    try:
+        first, last = [int(year) for year in value]
+    except (TypeError, ValueError):
+        raise ValueError('years is not first-last')
+
+    if not years[0] <= first <= last <= years[1]:
+        raise ValueError('years is not within {}-{}'.format(*years))
+
+    return [first, last]
+
+
+def parse_query(args, states, years):
+    '''The crimes, states, years, variables and table filter of an export
+    query string.
+
+    crimes, states and variables are comma separated and default to all,
+    years is first-last, and filter is a DataTable filter on the columns
+    of the table. spec, the JSON of the dashboard's filter spec, can be
+    given for crimes, states and years. states and years are those of the
+    data. Raises ValueError for anything unknown.
+    '''
+    if args.get('spec'):
+        try:
+            spec = json.loads(args['spec'])
+            crimes, states, years = (
+                check_list(spec['crimes'], crime_types, 'crimes'),
+                check_list(spec['states'], states, 'states'),
+                check_years(spec['years'], years))
+        except (TypeError, KeyError, json.JSONDecodeError):
+            raise ValueError('spec is not a filter spec')
+    else:
+        crimes = split_names(args.get('crimes'), crime_types, 'crimes')
+        states = split_names(args.get('states'), states, 'states')
+
+        if args.get('years'):
+            years = check_years(args['years'].split('-'), years)
+
+    parse_table_filter(args.get('filter'), get_crime_columns(crimes))
+
+    return {
+        'crimes': crimes,
+        'states': states,
+        'years': years,
+        'variables': split_names(args.get('variables'), variables,
+                                 'variables'),
+        'filter': args.get('filter', '')
+    }
+
+
+def get_columns(query):
+    '''The columns of an export, in the order of the table'''
+
+    return base_columns + query['variables'] + query['crimes'] +\
+        ['total_crimes']
+
+
+def iter_csv(df, columns, chunk_rows=export_chunk_rows):
+    '''The rows as CSV, a chunk of rows at a time'''
+
+    # The header is written even without rows
+    for start in range(0, max(len(df), 1), chunk_rows):
+        chunk = df.iloc[start:start + chunk_rows][columns]
+        yield chunk.to_csv(index=False, header=start == 0).encode('utf-8')
+
+
+class ChunkSink(object):
+    '''A write only file holding what was written until it is taken, its
+    position counts every byte so the Parquet offsets stay right'''
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_parquet(df, columns, chunk_rows=export_chunk_rows):
+    '''The rows as Parquet, a row group per chunk of rows'''
+    schema = pyarrow.Schema.from_pandas(df.iloc[:0][columns],
+                                        preserve_index=False)
+    sink = ChunkSink()
+    writer = pyarrow.parquet.ParquetWriter(
+        pyarrow.PythonFile(sink, mode='w'), schema)
+
+    for start in range(0, len(df), chunk_rows):
+        chunk = df.iloc[start:start + chunk_rows][columns]
+        writer.write_table(pyarrow.Table.from_pandas(
+            chunk, schema=schema, preserve_index=False))
+        yield sink.take()
+
+    # The footer
+    writer.close()
+    yield sink.take()
+
+
+WRITERS = {
+    'csv': iter_csv,
+    'parquet': iter_parquet
+}
+
+
+def get_etag(data_key, spec, columns, table_filter, file_format):
+    '''The same in every process for the same data files and query'''
+    payload = json.dumps([data_key, spec, columns, table_filter,
+                          file_format], sort_keys=True)
+
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def get_export_path(data_dir, etag, file_format):
+
+    return os.path.join(data_dir, EXPORT_DIR,
+                        '{}.{}'.format(etag, file_format))
+
+
+def prune(export_dir, keep=max_exports):
+    '''Remove all but the most recently written exports'''
+    try:
+        paths = [os.path.join(export_dir, name)
+                 for name in os.listdir(export_dir)
+                 if not name.endswith('.tmp')]
+        paths.sort(key=os.path.getmtime, reverse=True)
+        for path in paths[keep:]:
+            os.remove(path)
+    except (IOError, OSError):
+        # Pruned at the same time by another worker
+        pass
+
+
+def write_through(chunks, path):
+    '''Yield the chunks, keeping them in the file at path once every chunk
+    is written. An interrupted download leaves no file.'''
+    tmp_path = '{}.{}.{}.tmp'.format(path, os.getpid(),
+                                     threading.get_ident())
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        f = open(tmp_path, 'wb')
+    except (IOError, OSError):
+        # Not kept, still served
+        yield from chunks
+        return
+
+    try:
+        with f:
+            for chunk in chunks:
+                f.write(chunk)
+                yield chunk
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    prune(os.path.dirname(path))
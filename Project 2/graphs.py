@@ -1,34 +1,53 @@
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
 import plotly.graph_objs as go
-import process
-from pandas.api.types import is_numeric_dtype
+
+from config import max_time_series_points, max_scatter_points, \
+    max_webgl_points, scatter_bins
+from downsample import downsample
+from model import predict
+
+
+@lru_cache(maxsize=256)
+def get_unique_labels(states, prefix):
+    '''Preformatted hover labels, the same few states are asked for on
+    every interaction'''
+
+    return np.array([prefix + state for state in states], dtype=object)
+
+
+def get_state_labels(states, prefix=''):
+    '''Hover label for every row, formatted once per distinct state'''
+    codes, uniques = pd.factorize(states)
+
+    return get_unique_labels(tuple(uniques), prefix)[codes]
 
 
 def create_map(dfm, crime_checks):
-    
-    # convert to int for formatting consistency
-    for col in crime_checks:
-        dfm[col] = dfm[col].astype(int)
 
-    # Plotly requirement
-    for col in dfm.columns:
-        dfm[col] = dfm[col].astype(str)
+    # Numbers go in customdata and are formatted by the hover template
+    columns = ['total_crimes'] + list(crime_checks)
+    customdata = np.column_stack([dfm[col].values for col in columns])
 
     # Create hover text
-    dfm['text'] = dfm['State'] + '<br>' + '<br>' +\
-        'Total Crimes: ' + dfm['total_crimes'] + '<br>' + '<br>'
-
-    for col in crime_checks:
-        dfm['text'] += col + ': ' + dfm[col] + '<br>'
+    hovertemplate = '%{text}<br><br>' +\
+        'Total Crimes: %{customdata[0]:d}<br><br>' +\
+        ''.join(['{}: %{{customdata[{}]:d}}<br>'.format(col, i + 1)
+                 for i, col in enumerate(crime_checks)]) +\
+        '<extra></extra>'
 
     data = [dict(
         type='choropleth',
         colorscale='Viridis',
         autocolorscale=False,
-        locations=dfm['State_Abbrev'],
-        z=dfm['total_crimes'].astype(float),
+        locations=dfm['State_Abbrev'].values,
+        z=dfm['total_crimes'].values.astype(float),
         locationmode='USA-states',
-        text=dfm['text'],
-        hoverinfo='text',
+        text=get_state_labels(dfm['State'].values),
+        customdata=customdata,
+        hovertemplate=hovertemplate,
         marker=dict(
             line=dict(
                 color='rgb(255,255,255)',
@@ -63,39 +82,100 @@ def create_map(dfm, crime_checks):
     return fig
 
 
-def create_scatter(dfs, variable, variable_type, state_abbrev, color):
-    ''''''
+def get_bin_edges(values, n_bins, log):
+    '''Equal width bins, in log space on a log axis'''
+    low, high = values.min(), values.max()
+    if low == high:
+        high = low + 1 if not log else low * 10
 
-    dfs = dfs[['State', 'Year', 'total_crimes', variable]]
-    dfs = process.drop_rows_with_zeros(dfs)
+    if log:
+        return np.geomspace(low, high, n_bins + 1)
 
-    # Round and change columns to strings
-    for col in dfs.columns:
-        if is_numeric_dtype(dfs[col]):
-            dfs[col] = dfs[col].round(2)
-        dfs[col] = dfs[col].astype(str)
+    return np.linspace(low, high, n_bins + 1)
 
-    # Create hover text
-    dfs['text'] = 'State: ' + dfs['State'] + '<br>' +\
-        'Year: ' + dfs['Year'] + '<br>' +\
-        variable + ': ' + dfs[variable] + '<br>' +\
-        'Total Crimes: ' + dfs['total_crimes']
 
-    fig = {
-        'data': [go.Scatter(
-            x=dfs['total_crimes'],
-            y=dfs[variable],
+def get_bin_centers(edges, log):
+
+    if log:
+        return np.sqrt(edges[:-1] * edges[1:])
+
+    return (edges[:-1] + edges[1:]) / 2
+
+
+def create_scatter_density(x, y, variable, log, color):
+    '''Point counts on a 2-D grid of bins, for more points than the
+    browser draws quickly'''
+    x_edges = get_bin_edges(x, scatter_bins, log)
+    y_edges = get_bin_edges(y, scatter_bins, log)
+    counts, _, _ = np.histogram2d(x, y, bins=[x_edges, y_edges])
+
+    # Empty bins are left blank
+    z = counts.T
+    z[z == 0] = np.nan
+
+    return dict(
+        type='heatmap',
+        x=get_bin_centers(x_edges, log),
+        y=get_bin_centers(y_edges, log),
+        z=z,
+        colorscale='Viridis' if color is None else
+        [[0, 'rgb(250, 250, 250)'], [1, color]],
+        hovertemplate='Total Crimes: %{x:.0f}<br>' +
+        variable + ': %{y:.2f}<br>' +
+        'Points: %{z:d}<extra></extra>'
+    )
+
+
+def create_scatter(dfs, variable, variable_type, state_abbrev, color,
+                   valid=None):
+    '''SVG markers for few points, WebGL markers past
+    config.max_scatter_points and a binned density past
+    config.max_webgl_points. valid masks the rows to plot.'''
+
+    x = dfs['total_crimes'].to_numpy(float, na_value=np.nan)
+    y = dfs[variable].to_numpy(float, na_value=np.nan)
+    log = variable_type != 'Linear'
+
+    # Omit all zeros and NANs, unless already masked
+    if valid is None:
+        valid = (x != 0) & (y != 0) & ~np.isnan(x) & ~np.isnan(y)
+
+    n_points = np.count_nonzero(valid)
+
+    if n_points > max_webgl_points:
+        # Log bins only hold positive values, as a log axis would show
+        if log:
+            valid &= (x > 0) & (y > 0)
+
+        trace = create_scatter_density(x[valid], y[valid], variable, log,
+                                       color)
+    else:
+        # Create hover text
+        hovertemplate = '%{text}<br>' +\
+            'Year: %{customdata}<br>' +\
+            variable + ': %{y:.2f}<br>' +\
+            'Total Crimes: %{x}' +\
+            '<extra></extra>'
+
+        trace = dict(
+            type='scattergl' if n_points > max_scatter_points else 'scatter',
+            x=x[valid],
+            y=y[valid],
             mode='markers',
-            text=dfs['text'],
-            hoverinfo='text',
+            text=get_state_labels(dfs['State'].values[valid], 'State: '),
+            customdata=dfs['Year'].values[valid],
+            hovertemplate=hovertemplate,
             marker={
                 'size': 15,
                 'opacity': 0.5,
                 'line': {'width': 0.5, 'color': 'white'},
                 'color': color
             }
-        )],
-        'layout': go.Layout(
+        )
+
+    fig = {
+        'data': [trace],
+        'layout': dict(
             xaxis={
                 'title': 'Total Crimes',
                 'type': 'linear' if variable_type == 'Linear' else 'log'
@@ -105,7 +185,7 @@ def create_scatter(dfs, variable, variable_type, state_abbrev, color):
                 'type': 'linear' if variable_type == 'Linear' else 'log'
             },
             margin={'l': 40, 'b': 30, 't': 10, 'r': 0},
-            
+
             height=400,
             hovermode='closest',
             plot_bgcolor='rgb(250, 250, 250)'
@@ -115,13 +195,51 @@ def create_scatter(dfs, variable, variable_type, state_abbrev, color):
     return fig
 
 
+def add_fit(fig, fit, family, low, high, log, color):
+    '''Draw the expected total crimes of a count model fit over a scatter
+    of the variable between low and high, with its coefficient'''
+    grid = np.geomspace(low, high, 100) if log and low > 0 else\
+        np.linspace(low, high, 100)
+    total = fit.loc['total_crimes']
+
+    fig['data'].append(dict(
+        type='scatter',
+        x=predict(fit, 'total_crimes', grid),
+        y=grid,
+        mode='lines',
+        hoverinfo='skip',
+        line={'color': color or 'rgb(31, 119, 180)', 'width': 2}
+    ))
+
+    fig['layout']['showlegend'] = False
+    fig['layout']['annotations'] = [{
+        'x': 0, 'y': 1, 'xanchor': 'left', 'yanchor': 'top',
+        'xref': 'paper', 'yref': 'paper', 'showarrow': False,
+        'align': 'left', 'bgcolor': 'rgba(255, 255, 255, 0.5)',
+        'text': '{} fit: log(Total Crimes) = {:.4g} + {:.4g} x<br>'
+                'SE {:.3g}, p = {:.3g}, n = {:d}'.format(
+                    family, total['intercept'], total['slope'],
+                    total['slope_error'], total['p'], int(total['rows']))
+    }]
+
+    return fig
+
+
 def create_time_series(dfs, axis_type, yaxis_column_name, title, color,
-                       year_line, agg):
-    ''''''
+                       year_line, agg, x='Year'):
+    '''x is the time column to aggregate by, Year or Date'''
     if agg == 'Sum':
-        dfpiv = dfs.groupby('Year').sum().reset_index()
+        dfpiv = dfs.groupby(x).sum().reset_index()
     else:
-        dfpiv = dfs.groupby('Year').mean().reset_index()
+        dfpiv = dfs.groupby(x).mean().reset_index()
+
+    # Nullable counts aggregate to nullable results, plotted as floats
+    dfpiv[yaxis_column_name] = dfpiv[yaxis_column_name].astype(float)
+
+    # Keep long histories to a bounded number of points
+    if len(dfpiv) > max_time_series_points:
+        dfpiv = downsample(dfpiv, x, yaxis_column_name,
+                           max_time_series_points)
 
     # Get the minimumm without zeros to draw the vertical line
     line_min = dfpiv[dfpiv[yaxis_column_name] > 0][yaxis_column_name].min()
@@ -129,6 +247,10 @@ def create_time_series(dfs, axis_type, yaxis_column_name, title, color,
     shapes = []
 
     if year_line:
+        # A year on a date axis is its first day
+        if x != 'Year':
+            year_line = '{}-01-01'.format(year_line)
+
         shapes +=\
             [
                 # Vertical line
@@ -146,7 +268,7 @@ def create_time_series(dfs, axis_type, yaxis_column_name, title, color,
 
     return {
         'data': [go.Scatter(
-            x=dfpiv['Year'],
+            x=dfpiv[x],
             y=dfpiv[yaxis_column_name],
             mode='lines+markers',
             marker={
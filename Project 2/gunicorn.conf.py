@@ -0,0 +1,80 @@
+# Gunicorn settings for the dashboard, used as
+#
+#     gunicorn -c gunicorn.conf.py wsgi:server
+#
+# Environment variables:
+#     PORT             port to bind on (default 8050)
+#     WEB_CONCURRENCY  number of worker processes (default 2 x cores + 1)
+#     WORKER_THREADS   threads per worker (default 2)
+#     SECRET_KEY       Flask secret key, read by app.py
+#     METRICS_DIR      where the workers keep their metrics for /metrics
+#                      (default data/.metrics, emptied at start)
+import glob
+import importlib
+import multiprocessing
+import os
+import sys
+
+
+# Run from this directory, the data paths are relative to it
+chdir = os.path.dirname(os.path.abspath(__file__))
+
+bind = '0.0.0.0:{}'.format(os.environ.get('PORT', '8050'))
+workers = int(os.environ.get('WEB_CONCURRENCY',
+                             multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('WORKER_THREADS', 2))
+
+# Workers load the app themselves, the data is shared through the memory
+# mapped column files rather than by forking a loaded master
+preload_app = False
+
+# The libraries are imported once in the master, so forked workers start
+# with them loaded and only run app.py (the data is read from the columnar
+# copies and the derived objects from their snapshot)
+preload_modules = ['numpy', 'pandas', 'flask', 'plotly', 'dash',
+                   'dash_core_components', 'dash_html_components',
+                   'dash_table']
+
+# Restarted workers attach to the same files, so recycling them is cheap
+max_requests = 1000
+max_requests_jitter = 100
+
+
+def on_starting(server):
+    '''Convert the data once in the master before any worker maps it, and
+    import the libraries the workers share'''
+    sys.path.insert(0, chdir)
+
+    for name in preload_modules:
+        importlib.import_module(name)
+
+    import storage
+    from config import column_dtypes
+
+    for name in ['Year_df.csv', 'Month_df.csv']:
+        storage.ensure_columns(os.path.join(chdir, 'data', name),
+                               column_dtypes)
+
+    # The metrics of every worker are summed from this directory, the
+    # counts start over with the server
+    metrics_dir = os.environ.setdefault(
+        'METRICS_DIR', os.path.join(chdir, 'data', '.metrics'))
+    os.makedirs(metrics_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(metrics_dir, '*')):
+        os.remove(path)
+
+
+def worker_exit(server, worker):
+    '''Write the last metrics of a worker, which are otherwise written at
+    most every few seconds'''
+    import metrics
+
+    metrics.flush()
+
+
+def child_exit(server, worker):
+    '''Add the counts of an exited worker to those of the exited workers,
+    dropping its gauges and file'''
+    import metrics
+
+    metrics.mark_process_dead(worker.pid, os.environ['METRICS_DIR'])
@@ -0,0 +1,513 @@
+'''Prometheus metrics of the callbacks, served on /metrics.
+
+Every gunicorn worker records its own metrics. When METRICS_DIR is set,
+as gunicorn.conf.py does, each process also keeps them in a file of that
+directory, written at most every config.metrics_flush_interval seconds,
+on a scrape and when it exits. /metrics sums the histograms and counters
+of every worker that ever ran, so a scrape gives the same totals whichever
+worker answers, up to the counts of the other workers since their last
+write. The counts of exited workers are folded into one file and theirs
+removed. Gauges and startup times are per process and labelled with its
+worker pid. Without METRICS_DIR only the process answering is reported.
+'''
+import fcntl
+import functools
+import glob
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import flask
+
+import cache
+
+from config import metrics_flush_interval
+
+
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0)
+BYTES_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+ROWS_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000)
+
+# name: (help, buckets)
+METRICS = OrderedDict([
+    ('dash_callback_duration_seconds',
+     ('Wall time of the callback function', SECONDS_BUCKETS)),
+    ('dash_callback_frame_seconds',
+     ('Time spent building DataFrames in the callback', SECONDS_BUCKETS)),
+    ('dash_callback_serialize_seconds',
+     ('Time spent serializing the response outside the callback',
+      SECONDS_BUCKETS)),
+    ('dash_callback_request_bytes',
+     ('Size of the callback request body', BYTES_BUCKETS)),
+    ('dash_callback_response_bytes',
+     ('Size of the callback response body before compression',
+      BYTES_BUCKETS)),
+    ('dash_callback_rows',
+     ('Rows of data the callback worked on', ROWS_BUCKETS)),
+])
+
+# name: help
+COUNTERS = OrderedDict([
+    ('dash_callback_superseded_total',
+     'Callback requests dropped for a newer request of the same session'),
+])
+
+# name: help
+GAUGES = OrderedDict([
+    ('dash_data_generation',
+     'Number of times the data was loaded by this process'),
+    ('dash_data_load_seconds', 'Time the last load of the data took'),
+    ('dash_data_loaded_timestamp_seconds',
+     'When the data in use was loaded'),
+])
+
+DASH_UPDATE_PATH = '_dash-update-component'
+
+# metric: callback id: [bucket counts..., sum, count]
+_histograms = {name: OrderedDict() for name in METRICS}
+# metric: callback id: count
+_counters = {name: OrderedDict() for name in COUNTERS}
+_gauges = OrderedDict()
+_lock = threading.Lock()
+
+# Stage timings and row counts of the callback running on this thread
+_local = threading.local()
+
+# Seconds spent in each stage of starting this process
+_startup = OrderedDict()
+
+# The directory every process keeps its metrics in, see flush
+METRICS_DIR = os.environ.get('METRICS_DIR')
+_dirty = False
+_flushed = 0.
+_flush_timer = None
+
+# The name of the file summing the metrics of the exited workers
+EXITED = 'exited'
+
+
+def observe(name, callback_id, value):
+    global _dirty
+
+    buckets = METRICS[name][1]
+
+    with _lock:
+        _dirty = True
+        histogram = _histograms[name].setdefault(
+            callback_id, [0] * (len(buckets) + 2))
+
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                histogram[i] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+
+def increment(name, callback_id):
+    global _dirty
+
+    with _lock:
+        _dirty = True
+        _counters[name][callback_id] =\
+            _counters[name].get(callback_id, 0) + 1
+
+
+def set_gauge(name, value):
+    global _dirty
+
+    with _lock:
+        _dirty = True
+        _gauges[name] = value
+
+    # Set outside of requests, by the data reloads
+    flush()
+
+
+def get_callback_id(func):
+    '''The Dash id (output.property) of the callback being served'''
+
+    if flask.has_request_context():
+        body = flask.request.get_json(silent=True)
+        if body and 'output' in body:
+            return body['output']
+
+    return func.__name__
+
+
+def instrument(func):
+    '''Record the wall time, DataFrame time and rows of a callback'''
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        callback_id = get_callback_id(func)
+
+        _local.stages = {'frame': 0., 'rows': 0}
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            seconds = time.time() - start
+            stages = _local.stages
+            del _local.stages
+
+            observe('dash_callback_duration_seconds', callback_id, seconds)
+            observe('dash_callback_frame_seconds', callback_id,
+                    stages['frame'])
+            observe('dash_callback_rows', callback_id, stages['rows'])
+
+            if flask.has_request_context():
+                flask.g.metrics_callback = (callback_id, seconds)
+
+    return wrapper
+
+
+@contextmanager
+def timed(stage='frame'):
+    '''Add the time spent in the block to a stage of the current callback'''
+    start = time.time()
+    try:
+        yield
+    finally:
+        stages = getattr(_local, 'stages', None)
+        if stages is not None:
+            with _lock:
+                stages[stage] += time.time() - start
+
+
+def record_rows(rows):
+
+    stages = getattr(_local, 'stages', None)
+    if stages is not None:
+        with _lock:
+            stages['rows'] += rows
+
+
+def bind_stages(func):
+    '''Wrap func to add to the stages of the current callback when it
+    runs on another thread'''
+    stages = getattr(_local, 'stages', None)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        _local.stages = stages
+        try:
+            return func(*args, **kwargs)
+        finally:
+            del _local.stages
+
+    return wrapper
+
+
+def record_startup(stage, seconds):
+    global _dirty
+
+    with _lock:
+        _dirty = True
+        _startup[stage] = seconds
+
+
+@contextmanager
+def timed_startup(stage):
+    '''Record the time spent in the block as a startup stage'''
+    start = time.time()
+    try:
+        yield
+    finally:
+        record_startup(stage, time.time() - start)
+
+
+def get_startup():
+
+    return OrderedDict(_startup)
+
+
+def before_request():
+
+    if flask.request.path.endswith(DASH_UPDATE_PATH):
+        flask.g.metrics_start = time.time()
+
+
+def after_request(response):
+    '''Record the sizes and serialization time of a callback response,
+    before compress.py compresses it'''
+    start = flask.g.get('metrics_start')
+    callback = flask.g.get('metrics_callback')
+
+    if start is None or callback is None:
+        return response
+
+    callback_id, seconds = callback
+
+    # Dash serializes the return value after the callback returns
+    total = time.time() - start
+    observe('dash_callback_serialize_seconds', callback_id,
+            max(total - seconds, 0.))
+
+    observe('dash_callback_request_bytes', callback_id,
+            flask.request.content_length or 0)
+    if not response.is_streamed:
+        observe('dash_callback_response_bytes', callback_id,
+                len(response.get_data()))
+
+    return response
+
+
+def teardown_request(exception):
+
+    flush(metrics_flush_interval)
+
+
+def get_state():
+    '''A copy of the metrics of this process, as kept in its file'''
+    caches = {name: {stat: stats[stat] for stat in
+                     ['hits', 'misses', 'evictions']}
+              for name, stats in cache.get_stats().items()}
+
+    with _lock:
+        return json.loads(json.dumps({'histograms': _histograms,
+                                      'counters': _counters,
+                                      'gauges': _gauges,
+                                      'startup': _startup,
+                                      'caches': caches}))
+
+
+def get_path(pid, metrics_dir=None):
+
+    return os.path.join(metrics_dir or METRICS_DIR, '{}.json'.format(pid))
+
+
+def write_state(path, state):
+
+    tmp_path = '{}.{}.{}.tmp'.format(path, os.getpid(),
+                                     threading.get_ident())
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def flush(interval=0):
+    '''Keep the metrics of this process in its file of METRICS_DIR, when
+    they changed. Within interval seconds of the last write they are
+    written once the interval is over instead.'''
+    global _dirty, _flushed, _flush_timer
+
+    if METRICS_DIR is None or not _dirty:
+        return
+
+    wait = _flushed + interval - time.time()
+    if wait > 0:
+        with _lock:
+            if _flush_timer is None:
+                _flush_timer = threading.Timer(wait, flush)
+                _flush_timer.daemon = True
+                _flush_timer.start()
+        return
+
+    with _lock:
+        if _flush_timer is not None:
+            _flush_timer.cancel()
+            _flush_timer = None
+
+    _dirty = False
+    _flushed = time.time()
+    state = get_state()
+
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        write_state(get_path(os.getpid()), state)
+    except (IOError, OSError):
+        _dirty = True
+
+
+@contextmanager
+def locked(metrics_dir, operation):
+    '''Hold the lock of the directory, shared to read the files and
+    exclusive to fold one into another'''
+    os.makedirs(metrics_dir, exist_ok=True)
+
+    with open(os.path.join(metrics_dir, EXITED + '.lock'), 'a') as f:
+        fcntl.flock(f, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def read_state(path):
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def mark_process_dead(pid, metrics_dir=None):
+    '''Add the counts of a worker that exited to those of the exited
+    workers and remove its file, dropping its gauges. Called by gunicorn
+    in the master.'''
+    metrics_dir = metrics_dir or METRICS_DIR
+    path = get_path(pid, metrics_dir)
+    exited_path = get_path(EXITED, metrics_dir)
+
+    with locked(metrics_dir, fcntl.LOCK_EX):
+        try:
+            states = [(pid, read_state(path))]
+        except (IOError, OSError, ValueError):
+            return
+
+        if os.path.exists(exited_path):
+            states.append((EXITED, read_state(exited_path)))
+
+        histograms, counters, caches = merge_states(states)
+        write_state(exited_path, {'histograms': histograms,
+                                  'counters': counters, 'gauges': {},
+                                  'startup': {}, 'caches': caches})
+        os.remove(path)
+
+
+def get_states():
+    '''(worker pid, metrics) of every process, the pid None without
+    METRICS_DIR and EXITED for the exited workers'''
+
+    if METRICS_DIR is None:
+        return [(None, get_state())]
+
+    flush()
+
+    # Not while the file of an exited worker is folded, which would count
+    # it twice or not at all
+    states = []
+    with locked(METRICS_DIR, fcntl.LOCK_SH):
+        for path in sorted(glob.glob(os.path.join(METRICS_DIR, '*.json'))):
+            try:
+                states.append((os.path.basename(path)[:-len('.json')],
+                               read_state(path)))
+            except (IOError, OSError, ValueError):
+                # Removed or replaced while listing
+                continue
+
+    return states
+
+
+def merge_states(states):
+    '''The histograms, counters and cache stats summed over the processes'''
+    histograms = {name: OrderedDict() for name in METRICS}
+    counters = {name: OrderedDict() for name in COUNTERS}
+    caches = OrderedDict()
+
+    for pid, state in states:
+        for name in METRICS:
+            for callback_id, histogram in state['histograms'].get(
+                    name, {}).items():
+                total = histograms[name].setdefault(
+                    callback_id, [0] * len(histogram))
+                for i, value in enumerate(histogram):
+                    total[i] += value
+
+        for name in COUNTERS:
+            for callback_id, count in state['counters'].get(
+                    name, {}).items():
+                counters[name][callback_id] =\
+                    counters[name].get(callback_id, 0) + count
+
+        for cache_name, stats in state['caches'].items():
+            total = caches.setdefault(cache_name, OrderedDict())
+            for stat, value in stats.items():
+                total[stat] = total.get(stat, 0) + value
+
+    return histograms, counters, caches
+
+
+def format_labels(**labels):
+
+    return '{' + ','.join('{}="{}"'.format(key, value)
+                          for key, value in labels.items()) + '}'
+
+
+def get_worker_labels(pid, **labels):
+    '''The labels of a per process value, with the worker pid when
+    several processes are reported'''
+
+    if pid is not None:
+        labels = OrderedDict(labels, worker=pid)
+
+    return format_labels(**labels) if labels else ''
+
+
+def render():
+    '''All metrics in the Prometheus text format'''
+    lines = []
+
+    states = get_states()
+    histograms, counters, caches = merge_states(states)
+
+    for name, (help_text, buckets) in METRICS.items():
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} histogram'.format(name))
+
+        for callback_id, histogram in histograms[name].items():
+            for bound, count in zip(buckets, histogram):
+                lines.append('{}_bucket{} {}'.format(
+                    name, format_labels(callback=callback_id, le=bound),
+                    count))
+            lines.append('{}_bucket{} {}'.format(
+                name, format_labels(callback=callback_id, le='+Inf'),
+                histogram[-1]))
+            lines.append('{}_sum{} {}'.format(
+                name, format_labels(callback=callback_id), histogram[-2]))
+            lines.append('{}_count{} {}'.format(
+                name, format_labels(callback=callback_id), histogram[-1]))
+
+    for name, help_text in COUNTERS.items():
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} counter'.format(name))
+
+        for callback_id, count in counters[name].items():
+            lines.append('{}{} {}'.format(
+                name, format_labels(callback=callback_id), count))
+
+    for name, help_text in GAUGES.items():
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} gauge'.format(name))
+
+        for pid, state in states:
+            if name in state['gauges']:
+                lines.append('{}{} {}'.format(
+                    name, get_worker_labels(pid), state['gauges'][name]))
+
+    for stat in ['hits', 'misses', 'evictions']:
+        name = 'dash_cache_{}_total'.format(stat)
+        lines.append('# HELP {} Cache {} since start'.format(name, stat))
+        lines.append('# TYPE {} counter'.format(name))
+        for cache_name, stats in caches.items():
+            lines.append('{}{} {}'.format(
+                name, format_labels(cache=cache_name), stats[stat]))
+
+    name = 'dash_startup_seconds'
+    lines.append('# HELP {} Time spent in each stage of starting the '
+                 'process'.format(name))
+    lines.append('# TYPE {} gauge'.format(name))
+    for pid, state in states:
+        for stage, seconds in state['startup'].items():
+            lines.append('{}{} {}'.format(
+                name, get_worker_labels(pid, stage=stage), seconds))
+
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view():
+
+    return flask.Response(render(),
+                          mimetype='text/plain; version=0.0.4')
+
+
+def init_app(server):
+    '''Time the Dash callback requests and serve /metrics. Flask runs the
+    after_request functions last registered first, so this is called
+    after compress.init_app to record the uncompressed responses.'''
+    server.before_request(before_request)
+    server.after_request(after_request)
+    server.teardown_request(teardown_request)
+    server.add_url_rule('/metrics', 'metrics', metrics_view)
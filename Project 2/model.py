@@ -0,0 +1,138 @@
+'''Count regressions of the crimes on a variable, as in the Negative
+Binomial Model notebook, fitted with numpy.
+
+The GLMs have a log link and are fitted by iteratively reweighted least
+squares, batched over several responses that share the design matrix
+(every crime type against one variable) so each iteration is one stacked
+solve. The negative binomial has a fixed alpha, the statsmodels default.
+'''
+import math
+
+import numpy as np
+import pandas as pd
+
+from config import nb_alpha, model_max_iterations, model_tolerance
+
+
+FAMILIES = ['Poisson', 'Negative Binomial']
+
+# Keep exp() finite while the first iterations overshoot
+MAX_ETA = 700.
+
+
+def get_weights(mu, family, alpha=nb_alpha):
+    '''IRLS weights of a log link GLM'''
+
+    if family == 'Poisson':
+        return mu
+
+    return mu / (1. + alpha * mu)
+
+
+def get_deviance(y, mu, family, alpha=nb_alpha):
+    '''Deviance of every response (column)'''
+    # y log(y / mu), 0 where y is 0
+    ylogy = np.where(y > 0, y * np.log(np.where(y > 0, y, 1.) / mu), 0.)
+
+    if family == 'Poisson':
+        return 2. * (ylogy - (y - mu)).sum(axis=0)
+
+    return 2. * (ylogy - (y + 1. / alpha) *
+                 np.log((1. + alpha * y) / (1. + alpha * mu))).sum(axis=0)
+
+
+def fit_glm(X, Y, family='Poisson', beta=None, alpha=nb_alpha,
+            max_iterations=model_max_iterations, tolerance=model_tolerance):
+    '''Fit a log link GLM of every column of Y (n, k) on X (n, p).
+
+    beta (p, k) warm starts the fit. Returns the coefficients (p, k), their
+    standard errors, the deviances and the iterations run.
+    '''
+    n, p = X.shape
+
+    if beta is None:
+        # Start at the mean of every response and no slope
+        beta = np.zeros((p, Y.shape[1]))
+        beta[0] = np.log(np.maximum(Y.mean(axis=0), 1e-8))
+
+    deviance = np.inf
+    for iteration in range(1, max_iterations + 1):
+        eta = np.clip(X @ beta, -MAX_ETA, MAX_ETA)
+        mu = np.exp(eta)
+        w = get_weights(mu, family, alpha)
+        z = eta + (Y - mu) / mu
+
+        # X' W X and X' W z of every response, solved together
+        xtwx = np.einsum('ni,nk,nj->kij', X, w, X)
+        xtwz = np.einsum('ni,nk->ki', X, w * z)
+        beta = np.linalg.solve(xtwx, xtwz[:, :, None])[:, :, 0].T
+
+        mu = np.exp(np.clip(X @ beta, -MAX_ETA, MAX_ETA))
+        new_deviance = get_deviance(Y, mu, family, alpha)
+
+        converged = np.abs(new_deviance - deviance) <=\
+            tolerance * (np.abs(new_deviance) + 0.1)
+        deviance = new_deviance
+        if converged.all():
+            break
+
+    # The covariance at the solution, the scale is 1 for both families
+    w = get_weights(mu, family, alpha)
+    covariance = np.linalg.inv(np.einsum('ni,nk,nj->kij', X, w, X))
+    errors = np.sqrt(np.diagonal(covariance, axis1=1, axis2=2)).T
+
+    return beta, errors, deviance, iteration
+
+
+def fit_crime_models(dfs, crimes, variable, family, warm=None):
+    '''Fit every crime (and total_crimes) on the variable over the rows of
+    dfs with both.
+
+    The variable is standardized for the fit and the coefficients turned
+    back to its units. warm is the table of an earlier fit to start from.
+    Returns a table of the intercept and slope, with the standard error,
+    z and p value of the slope, the deviance and rows of every response.
+    '''
+    responses = list(crimes) + ['total_crimes']
+
+    x = dfs[variable].to_numpy(float, na_value=np.nan)
+    Y = dfs[responses].to_numpy(float, na_value=np.nan)
+    rows = ~np.isnan(x) & (x != 0) & (Y[:, -1] > 0)
+    x, Y = x[rows], np.nan_to_num(Y[rows])
+
+    if len(x) < 3 or x.std() == 0:
+        return None
+
+    center, scale = x.mean(), x.std()
+    X = np.column_stack([np.ones(len(x)), (x - center) / scale])
+
+    beta = None
+    if warm is not None and list(warm.index) == responses:
+        # Back to the standardized units of this fit
+        slope = warm['slope'].values * scale
+        beta = np.vstack([warm['intercept'].values + slope * center / scale,
+                          slope])
+
+    beta, errors, deviance, iterations = fit_glm(X, Y, family, beta)
+
+    slope = beta[1] / scale
+    slope_error = errors[1] / scale
+    z = beta[1] / errors[1]
+
+    return pd.DataFrame({
+        'intercept': beta[0] - beta[1] * center / scale,
+        'slope': slope,
+        'slope_error': slope_error,
+        'z': z,
+        'p': [math.erfc(abs(value) / math.sqrt(2)) for value in z],
+        'deviance': deviance,
+        'rows': len(x),
+        'iterations': iterations
+    }, index=responses)
+
+
+def predict(fit, response, values):
+    '''Expected count of a response at the given variable values'''
+    coefficients = fit.loc[response]
+
+    return np.exp(coefficients['intercept'] + coefficients['slope'] * values)
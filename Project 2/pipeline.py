@@ -0,0 +1,361 @@
+'''Build Year_df.csv and Month_df.csv from the component CSVs.
+
+The steps of the Data Cleaning Part 2 notebook as an importable, repeatable
+pipeline. Sources are read in chunks and joined on their key index, and a
+manifest of per year content hashes of every source means a refresh only
+recomputes the years whose inputs changed, are new or were removed. The
+rows keep the order (and line endings) of the existing output, with the
+rows of new keys after them:
+
+    python pipeline.py            # refresh changed years
+    python pipeline.py --full     # rebuild everything
+'''
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+CHUNKSIZE = 100000
+MANIFEST = '.pipeline_manifest.json'
+
+# Joined with the Income states, D.C. and the national rows get no
+# abbreviation as in the notebook
+STATE_ABBREVS = {
+    'District of Columbia': 'DC', 'Alabama': 'AL', 'Montana': 'MT',
+    'Alaska': 'AK', 'Nebraska': 'NE', 'Arizona': 'AZ', 'Nevada': 'NV',
+    'Arkansas': 'AR', 'New Hampshire': 'NH', 'California': 'CA',
+    'New Jersey': 'NJ', 'Colorado': 'CO', 'New Mexico': 'NM',
+    'Connecticut': 'CT', 'New York': 'NY', 'Delaware': 'DE',
+    'North Carolina': 'NC', 'Florida': 'FL', 'North Dakota': 'ND',
+    'Georgia': 'GA', 'Ohio': 'OH', 'Hawaii': 'HI', 'Oklahoma': 'OK',
+    'Idaho': 'ID', 'Oregon': 'OR', 'Illinois': 'IL', 'Pennsylvania': 'PA',
+    'Indiana': 'IN', 'Rhode Island': 'RI', 'Iowa': 'IA',
+    'South Carolina': 'SC', 'Kansas': 'KS', 'South Dakota': 'SD',
+    'Kentucky': 'KY', 'Tennessee': 'TN', 'Louisiana': 'LA', 'Texas': 'TX',
+    'Maine': 'ME', 'Utah': 'UT', 'Maryland': 'MD', 'Vermont': 'VT',
+    'Massachusetts': 'MA', 'Virginia': 'VA', 'Michigan': 'MI',
+    'Washington': 'WA', 'Minnesota': 'MN', 'West Virginia': 'WV',
+    'Mississippi': 'MS', 'Wisconsin': 'WI', 'Missouri': 'MO',
+    'Wyoming': 'WY'}
+
+WEATHER_COLUMNS = ['TAVG', 'TMIN', 'TMAX']
+STORM_MEASURES = ['INJURIES_DIRECT', 'INJURIES_INDIRECT', 'DEATHS_DIRECT',
+                  'DEATHS_INDIRECT', 'DAMAGE_PROPERTY', 'DAMAGE_CROPS']
+
+# The key columns of each output, rows of new keys are written after the
+# existing rows in this order
+KEYS = {
+    'Year_df.csv': ['Year', 'State'],
+    'Month_df.csv': ['Year', 'Month', 'State']
+}
+
+# The inputs of each output, Storm_Events.csv is optional
+OUTPUTS = {
+    'Year_df.csv': ['Income.csv', 'Weather.csv', 'Health.csv',
+                    'Population.csv', 'Gas_Price.csv', 'Crimes.csv',
+                    'SPI.csv', 'Storm_Events.csv'],
+    'Month_df.csv': ['Weather.csv', 'SPI.csv', 'Storm_Events.csv']
+}
+
+
+def read_chunks(path, years=None, chunksize=CHUNKSIZE, **kwargs):
+    '''Stream a CSV, keeping only the rows of the given years'''
+
+    for chunk in pd.read_csv(path, chunksize=chunksize, **kwargs):
+        if years is not None:
+            chunk = chunk[chunk['Year'].isin(years)]
+        yield chunk
+
+
+def read_rows(path, years=None, chunksize=CHUNKSIZE):
+
+    chunks = list(read_chunks(path, years, chunksize))
+
+    return pd.concat(chunks, ignore_index=True)
+
+
+def stream_mean(chunks, keys, columns):
+    '''Group means over a stream of chunks, from running sums and counts'''
+    sums = counts = None
+
+    for chunk in chunks:
+        grouped = chunk.groupby(keys)[columns]
+        if sums is None:
+            sums, counts = grouped.sum(), grouped.count()
+        else:
+            sums = sums.add(grouped.sum(), fill_value=0)
+            counts = counts.add(grouped.count(), fill_value=0)
+
+    # All missing gives 0 / 0, NaN as with a plain mean
+    return sums / counts
+
+
+def stream_sum(chunks, keys):
+
+    total = None
+
+    for chunk in chunks:
+        sums = chunk.groupby(keys).sum()
+        total = sums if total is None else total.add(sums, fill_value=0)
+
+    return total
+
+
+def hash_years(path, chunksize=CHUNKSIZE):
+    '''Content hash and row count of every year of a source.
+
+    Rows are hashed as text so the hash does not depend on the dtypes
+    inferred per chunk, and summed so it does not depend on row order.
+    '''
+    hashes = {}
+
+    for chunk in read_chunks(path, chunksize=chunksize, dtype=str,
+                             keep_default_na=False):
+        row_hashes = pd.util.hash_pandas_object(chunk, index=False).values
+        codes, years = pd.factorize(chunk['Year'].astype(float)
+                                    .astype(int))
+
+        sums = np.zeros(len(years), dtype=np.uint64)
+        np.add.at(sums, codes, row_hashes)
+        counts = np.bincount(codes, minlength=len(years))
+
+        for year, row_sum, count in zip(years, sums, counts):
+            old_sum, old_count = hashes.get(int(year), (0, 0))
+            hashes[int(year)] = ((old_sum + int(row_sum)) % 2 ** 64,
+                                 old_count + int(count))
+
+    return {str(year): '{:016x}-{}'.format(row_sum, count)
+            for year, (row_sum, count) in hashes.items()}
+
+
+def read_storms(data_dir, keys, years, chunksize=CHUNKSIZE):
+    '''Storm event counts by type plus the damage measures, None when
+    Storm_Events.csv is not in the data directory'''
+    path = os.path.join(data_dir, 'Storm_Events.csv')
+
+    if not os.path.exists(path):
+        return None
+
+    def prepare(chunks):
+        for chunk in chunks:
+            chunk = chunk.rename(columns={'STATE': 'State', 'YEAR': 'Year'})
+            chunk['State'] = chunk['State'].str.lower().str.title()
+            events = pd.get_dummies(chunk['EVENT_TYPE'])
+            yield pd.concat([chunk[keys + STORM_MEASURES], events], axis=1)
+
+    return stream_sum(prepare(read_chunks(path, years, chunksize)), keys)
+
+
+def join_storms(df, data_dir, keys, years, chunksize, previous):
+    '''Add the storm columns, carried over from the previous output when
+    Storm_Events.csv is not in the data directory'''
+    storms = read_storms(data_dir, keys, years, chunksize)
+
+    if storms is not None:
+        return df.join(storms, on=keys)
+
+    if previous is None:
+        return df
+
+    storm_columns = [col for col in previous.columns if col not in df]
+
+    return df.join(previous.set_index(keys)[storm_columns], on=keys)
+
+
+def build_year_df(data_dir, years=None, chunksize=CHUNKSIZE,
+                  previous=None):
+    '''Year_df rows for the given years (all when None)'''
+
+    def path(name):
+        return os.path.join(data_dir, name)
+
+    # Income decides the rows, as the right join in the notebook
+    df = read_rows(path('Income.csv'), years, chunksize)
+    df['State_Abbrev'] = df['State'].map(STATE_ABBREVS)
+
+    weather = stream_mean(
+        (chunk.rename(columns=lambda col: col.strip())
+         for chunk in read_chunks(path('Weather.csv'), years, chunksize)),
+        ['State', 'Year'], WEATHER_COLUMNS)
+    df = df.join(weather, on=['State', 'Year'])
+
+    health = read_rows(path('Health.csv'), years, chunksize)
+    df = df.join(health.set_index(['State', 'Year']), on=['State', 'Year'])
+
+    for name in ['Population.csv', 'Gas_Price.csv', 'Crimes.csv']:
+        source = read_rows(path(name), years, chunksize)
+        df = df.join(source.set_index(['State_Abbrev', 'Year']),
+                     on=['State_Abbrev', 'Year'])
+
+    spi = stream_mean(
+        (chunk.rename(columns={'State': 'State_Abbrev'})
+         for chunk in read_chunks(path('SPI.csv'), years, chunksize)),
+        ['State_Abbrev', 'Year'], ['SPI'])
+    df = df.join(spi, on=['State_Abbrev', 'Year'])
+
+    return join_storms(df, data_dir, ['State', 'Year'], years, chunksize,
+                       previous)
+
+
+def build_month_df(data_dir, years=None, chunksize=CHUNKSIZE,
+                   previous=None):
+    '''Month_df rows for the given years (all when None)'''
+    keys = ['Year', 'Month', 'State']
+
+    weather = stream_mean(
+        (chunk.rename(columns=lambda col: col.strip())
+         for chunk in read_chunks(os.path.join(data_dir, 'Weather.csv'),
+                                  years, chunksize)),
+        keys, WEATHER_COLUMNS)
+    df = weather.reset_index()
+    df['State_Abbrev'] = df['State'].map(STATE_ABBREVS)
+
+    spi = read_rows(os.path.join(data_dir, 'SPI.csv'), years, chunksize)
+    spi = spi.rename(columns={'State': 'State_Abbrev'})
+    df = df.join(spi.set_index(['Year', 'Month', 'State_Abbrev']),
+                 on=['Year', 'Month', 'State_Abbrev'])
+
+    return join_storms(df, data_dir, keys, years, chunksize, previous)
+
+
+BUILDERS = {
+    'Year_df.csv': build_year_df,
+    'Month_df.csv': build_month_df
+}
+
+
+def read_manifest(data_dir):
+
+    try:
+        with open(os.path.join(data_dir, MANIFEST)) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def write_manifest(data_dir, manifest):
+
+    path = os.path.join(data_dir, MANIFEST)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def order_like(df, previous, keys):
+    '''The rows of df in the order of their keys in previous, the rows of
+    new keys after them sorted by key'''
+
+    if previous is None:
+        return df.sort_values(keys, kind='stable').reset_index(drop=True)
+
+    positions = pd.Series(np.arange(len(previous)), index=pd.MultiIndex
+                          .from_frame(previous[keys]))
+    positions = positions[~positions.index.duplicated()]
+
+    df = df.assign(_position=positions.reindex(
+        pd.MultiIndex.from_frame(df[keys])).values)
+    df = df.sort_values(['_position'] + keys, kind='stable',
+                        na_position='last')
+
+    return df.drop(columns='_position').reset_index(drop=True)
+
+
+def get_line_terminator(path):
+    '''The line ending of an existing CSV, to rewrite it the same'''
+
+    with open(path, 'rb') as f:
+        return '\r\n' if f.readline().endswith(b'\r\n') else '\n'
+
+
+def refresh(data_dir='data', full=False, chunksize=CHUNKSIZE):
+    '''Recompute the years of each output whose sources changed, were
+    added or were removed, returns the recomputed years per output'''
+    manifest = {} if full else read_manifest(data_dir)
+    source_hashes = {}
+    removed = set()
+    refreshed = {}
+
+    for output, sources in OUTPUTS.items():
+        output_path = os.path.join(data_dir, output)
+        previous = None
+        line_terminator = '\n'
+        if os.path.exists(output_path):
+            previous = pd.read_csv(output_path)
+            line_terminator = get_line_terminator(output_path)
+
+        # Years whose content hash differs in any source, or that are no
+        # longer in it
+        changed = set()
+        for source in sources:
+            source_path = os.path.join(data_dir, source)
+            old = manifest.get(source, {})
+
+            if not os.path.exists(source_path):
+                if old:
+                    removed.add(source)
+                changed |= {int(year) for year in old}
+                continue
+
+            if source not in source_hashes:
+                source_hashes[source] = hash_years(source_path, chunksize)
+
+            new = source_hashes[source]
+            changed |= {int(year) for year, digest in new.items()
+                        if old.get(year) != digest}
+            changed |= {int(year) for year in old if year not in new}
+
+        if previous is not None and not full:
+            years = sorted(changed)
+        else:
+            years = None
+
+        if years == []:
+            refreshed[output] = []
+            continue
+
+        df = BUILDERS[output](data_dir, years, chunksize, previous)
+
+        # Keep the unchanged years and add the recomputed ones, the years
+        # no longer in the sources are dropped
+        if years is not None:
+            kept = previous[~previous['Year'].isin(years)]
+            df = pd.concat([kept, df], ignore_index=True, sort=False)
+            df = df[list(previous.columns) +
+                    [col for col in df.columns
+                     if col not in previous.columns]]
+        elif previous is not None:
+            df = df.reindex(columns=list(previous.columns) +
+                            [col for col in df.columns
+                             if col not in previous.columns])
+
+        df = order_like(df, previous, KEYS[output])
+
+        tmp_path = output_path + '.tmp'
+        df.to_csv(tmp_path, index=False, lineterminator=line_terminator)
+        os.replace(tmp_path, output_path)
+
+        refreshed[output] = years if years is not None else\
+            sorted(df['Year'].unique().tolist())
+
+    manifest.update(source_hashes)
+    for source in removed:
+        del manifest[source]
+    write_manifest(data_dir, manifest)
+
+    return refreshed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data-dir', default='data')
+    parser.add_argument('--full', action='store_true',
+                        help='rebuild every year')
+    parser.add_argument('--chunksize', type=int, default=CHUNKSIZE)
+    args = parser.parse_args()
+
+    for output, years in refresh(args.data_dir, args.full,
+                                 args.chunksize).items():
+        print('{}: {} years recomputed'.format(output, len(years)))
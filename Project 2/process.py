@@ -1,26 +1,169 @@
-import pandas as pd
+import operator
 import os
+import re
+
+import numpy as np
+import pandas as pd
+
+import cube
+import storage
+
+from config import crime_types_original, variables, base_columns, crime_types
+from config import monthly_variables, column_dtypes
 
-from config import crime_types_original, variables, base_columns
+
+# The operators of the DataTable filter row
+TABLE_OPERATORS = {
+    'eq': operator.eq,
+    '=': operator.eq,
+    'ne': operator.ne,
+    '!=': operator.ne,
+    'gt': operator.gt,
+    '>': operator.gt,
+    'ge': operator.ge,
+    '>=': operator.ge,
+    'lt': operator.lt,
+    '<': operator.lt,
+    'le': operator.le,
+    '<=': operator.le
+}
+
+# A term of a filter expression like "State" eq Texas && "Year" > 2000,
+# the operators in any case
+TABLE_FILTER_TERM = re.compile(
+    r'^"?(?P<column>[^"]+?)"?\s+'
+    r'(?P<operator>eq|ne|gt|ge|lt|le|contains|>=|<=|!=|>|<|=)'
+    r'\s+(?P<value>.+)$', re.IGNORECASE)
 
 
 def get_data():
     ''''''
     data_dir = os.path.relpath('data/')
-    year_df = pd.read_csv(data_dir + '/Year_df.csv')
 
-    df = year_df[base_columns + variables + crime_types_original]
+    # Only the needed columns, memory mapped from the columnar copy
+    df = storage.read_csv(data_dir + '/Year_df.csv',
+                          base_columns + variables + crime_types_original,
+                          column_dtypes)
 
     # Rename columns
     crime_types = [' '.join(cr.split('_')).title() for cr in
                    crime_types_original]
 
+    # No copy, the columns may be memory mapped and shared
     df = df.rename(mapper=dict(zip(crime_types_original, crime_types)),
-                   axis='columns')
+                   axis='columns', copy=False)
+
+    return df
+
+
+def memory_report(df=None, csv_path='data/Year_df.csv'):
+    '''Bytes of every column as parsed from the CSV, before, and with the
+    config dtypes, after. df is the loaded frame (get_data() when None),
+    with the crime columns renamed back to the CSV names.'''
+    if df is None:
+        df = get_data()
+
+    df = df.rename(columns=dict(zip(crime_types, crime_types_original)))
+    before = pd.read_csv(os.path.relpath(csv_path), usecols=df.columns)
+
+    report = pd.DataFrame({
+        'dtype_before': before.dtypes.astype(str),
+        'bytes_before': before.memory_usage(index=False, deep=True),
+        'dtype_after': df.dtypes.astype(str),
+        'bytes_after': df.memory_usage(index=False, deep=True)
+    }).loc[df.columns]
+
+    report.loc['Total'] = ['', report['bytes_before'].sum(), '',
+                           report['bytes_after'].sum()]
+
+    return report
+
+
+def get_month_data():
+    '''The monthly observations, with a Date of the first of the month'''
+    data_dir = os.path.relpath('data/')
+
+    df = storage.read_csv(data_dir + '/Month_df.csv',
+                          ['Year', 'Month', 'State', 'State_Abbrev'] +
+                          monthly_variables, column_dtypes)
+
+    df.insert(2, 'Date', pd.to_datetime(dict(year=df['Year'],
+                                             month=df['Month'], day=1)))
 
     return df
 
 
+def get_crime_columns(crime_checks):
+    '''The columns of a crime selection, as the table shows them'''
+
+    return base_columns + variables +\
+        [cr for cr in crime_types if cr in crime_checks] + ['total_crimes']
+
+
+def get_crime_frame(df, crime_checks, crime_cube):
+    '''The data with the total of the selected crime types added.
+
+    The frame shares the columns of df, which may be memory mapped, and
+    only the total is new. Use get_crime_columns for the columns of the
+    selection.
+    '''
+
+    # Keep the config order so equal selections give equal frames
+    crime_checks = [cr for cr in crime_types if cr in crime_checks]
+
+    dfm = df.copy(deep=False)
+
+    # Read from the cube when it has one row per state and year
+    if crime_cube.counts.max() <= 1:
+        dfm['total_crimes'] = cube.get_row_totals(crime_cube, crime_checks)
+    else:
+        dfm['total_crimes'] = df[crime_checks].sum(axis=1)
+
+    return dfm
+
+
+def make_spec(crime_checks, state_checks, year_value):
+    '''Compact, canonical description of the dashboard filters'''
+
+    return {
+        'crimes': [cr for cr in crime_types if cr in crime_checks],
+        'states': sorted(state_checks, key=str),
+        'years': [int(year_value[0]), int(year_value[1])]
+    }
+
+
+def get_spec_positions(dfs, state_checks, year_value):
+    '''Positions of the rows of the states in the year range'''
+
+    return np.flatnonzero(((dfs['Year'] <= year_value[1]) &
+                           (dfs['Year'] >= year_value[0]) &
+                           dfs.State_Abbrev.isin(state_checks)).values)
+
+
+def take_rows(dfs, positions):
+    '''The rows at the positions, dfs itself when that is all of them'''
+
+    if len(positions) == len(dfs):
+        return dfs
+
+    return dfs.iloc[positions]
+
+
+def get_spec_rows(dfs, state_checks, year_value):
+
+    return take_rows(dfs, get_spec_positions(dfs, state_checks, year_value))
+
+
+def get_year_frame(dfs, agg):
+    '''Every variable of the rows aggregated by Year, as floats'''
+    grouped = dfs[['Year'] + variables].groupby('Year')
+
+    if agg == 'Sum':
+        return grouped.sum().astype(float).reset_index()
+
+    return grouped.mean().astype(float).reset_index()
+
+
 def get_state(dfs):
 
     try:
@@ -36,9 +179,125 @@ def get_state_dropdown(dfs, state_checks):
     return dfs[dfs.State_Abbrev.isin(state_checks)]
 
 
-def drop_rows_with_zeros(dfs):
+def get_validity(df, columns):
+    '''Masks of the rows of every column that are neither zero nor
+    missing, computed once when the data is loaded'''
+    values = df[columns].to_numpy(float, na_value=np.nan)
+
+    return pd.DataFrame((values != 0) & ~np.isnan(values), columns=columns,
+                        index=df.index)
+
+
+def parse_table_filter(filtering_settings, columns=None):
+    '''The (column, operator, value) terms of a DataTable filter, raises
+    ValueError for a term that is not one, or is on a column not in
+    columns when they are given'''
+    terms = []
+
+    for expression in re.split(r'\s+&&\s+', (filtering_settings or '')
+                               .strip()):
+        if not expression:
+            continue
+
+        match = TABLE_FILTER_TERM.match(expression)
+        if match is None:
+            raise ValueError('Unknown filter term: {}'.format(expression))
+
+        column, op, value = match.groups()
+        if columns is not None and column not in columns:
+            raise ValueError('Unknown filter column: {}'.format(column))
+        terms.append((column, op.lower(), value.strip().strip('"\'')))
+
+    return terms
+
+
+def get_table_mask(dfs, filtering_settings, columns=None):
+    '''Rows passing every term of a DataTable filter on the columns, by
+    default all of dfs. Raises ValueError for a term that can not be
+    parsed or is on another column.'''
+    mask = np.ones(len(dfs), dtype=bool)
+
+    for column, op, value in parse_table_filter(
+            filtering_settings, dfs.columns if columns is None else columns):
+        values = dfs[column]
+        if op == 'contains':
+            mask &= values.astype(str).str.contains(value, regex=False)\
+                .to_numpy(bool, na_value=False)
+            continue
+
+        # Numbers are compared as numbers
+        if values.dtype.kind in 'iufb':
+            try:
+                value = float(value)
+            except ValueError:
+                mask[:] = False
+                continue
+
+        try:
+            result = TABLE_OPERATORS[op](values, value)
+        except TypeError:
+            result = TABLE_OPERATORS[op](values.astype(str), value)
+
+        # Missing values of nullable columns do not pass
+        mask &= result.to_numpy(bool, na_value=False)
+
+    return mask
+
+
+def get_sort_ranks(values, direction='asc'):
+    '''Dense ranks of a column in the sort direction, missing values
+    last'''
+    codes, uniques = pd.factorize(values, sort=True)
+
+    if direction == 'desc':
+        codes = np.where(codes < 0, -1, len(uniques) - 1 - codes)
+
+    return np.where(codes < 0, len(uniques), codes)
+
+
+def get_table_order(mask, sorting_settings, get_ranks, columns):
+    '''Positions of the rows passing the filter mask, in the order of
+    the DataTable sorting. get_ranks(column, direction) gives the sort
+    ranks of a column, sorts by a column not in columns are skipped'''
+    order = np.flatnonzero(mask)
+
+    keys = [get_ranks(sort['column_id'], sort['direction'])[order]
+            for sort in sorting_settings or []
+            if sort['column_id'] in columns]
+
+    if keys:
+        # The first sort is the primary key, last for lexsort
+        order = order[np.lexsort(keys[::-1])]
+
+    return order
+
+
+def from_float32(values):
+    '''float32 values as the floats of their shortest repr, so JSON has
+    the 58.9333 of the CSV rather than 58.93333435058594'''
+
+    return np.asarray(values, dtype=np.float32).astype(str).astype(float)
+
+
+def get_float32_columns(dfs):
+
+    return [column for column in dfs.columns
+            if dfs[column].dtype == np.float32]
+
+
+def get_table_page(dfs, order, pagination_settings, columns=None):
+    '''The records of the current page with the columns, by default all
+    of dfs, and the index of every row as its row_id'''
+    page_size = pagination_settings['page_size']
+    start = pagination_settings['current_page'] * page_size
+
+    page = dfs.iloc[order[start:start + page_size]]
+    if columns is not None:
+        page = page[columns]
+    page = page.assign(**{column: from_float32(page[column])
+                          for column in get_float32_columns(page)})
 
-    # Omit all zeros and NANs
-    dfs = dfs.loc[~(dfs == 0).any(axis=1)]
+    # Missing values of the nullable and categorical columns as null
+    page = page.astype(object).where(page.notna(), None)
 
-    return dfs.dropna()
+    return page.assign(row_id=page.index.values).to_dict('records')
@@ -0,0 +1,155 @@
+'''Grouped aggregates of the data, the engine of the /api/query route.
+
+A query is a JSON object, every key optional:
+
+    {"crimes": ["Homicide"],           crime types in total_crimes
+     "states": ["CA", "TX"],           state abbreviations
+     "years": [1995, 2016],            first and last year
+     "filter": "\\"TAVG\\" > 60",        a DataTable filter on the rows
+     "group_by": ["State", "Year"],    any of State, Year and Month
+     "measures": ["total_crimes"],     variables, crime types, total_crimes
+     "agg": "mean"}                    sum or mean, or one per measure
+
+Grouping by Month uses the monthly observations, which only hold
+config.monthly_variables. The app runs queries on its loaded frame and
+caches; Client sends them to a running app from a notebook or a job.
+'''
+import json
+from urllib.request import Request, urlopen
+
+import pandas as pd
+
+from config import crime_types, variables, monthly_variables, base_columns
+
+from export import check_names
+from process import parse_table_filter, from_float32, get_float32_columns
+
+
+GROUPS = ['State', 'Year', 'Month']
+AGGS = ['sum', 'mean']
+MEASURES = variables + crime_types + ['total_crimes']
+
+# The columns a filter can use, of the yearly rows and of the monthly ones
+COLUMNS = base_columns + MEASURES
+MONTH_COLUMNS = ['Year', 'Month', 'Date', 'State', 'State_Abbrev'] +\
+    monthly_variables
+
+
+def get_names(body, key, names, what):
+    '''A list of known names from the query, all of them when missing'''
+    value = body.get(key)
+
+    if value is None:
+        return list(names)
+    if not isinstance(value, list):
+        raise ValueError('{} is not a list'.format(key))
+
+    return check_names(value, names, what)
+
+
+def parse_query(body, states, years):
+    '''The query with its defaults, raises ValueError for anything
+    unknown. states and years are those of the data.'''
+
+    if not isinstance(body, dict):
+        raise ValueError('The query is not an object')
+
+    unknown = set(body) - {'crimes', 'states', 'years', 'filter',
+                           'group_by', 'measures', 'agg'}
+    if unknown:
+        raise ValueError('Unknown keys: {}'.format(', '.join(
+            sorted(unknown))))
+
+    group_by = get_names(body, 'group_by', GROUPS, 'groups') \
+        if 'group_by' in body else ['Year']
+    measures = get_names(body, 'measures', MEASURES, 'measures') \
+        if 'measures' in body else ['total_crimes']
+
+    if 'Month' in group_by:
+        check_names(measures, monthly_variables, 'monthly variables')
+
+    if body.get('years') is not None:
+        try:
+            years = [int(year) for year in body['years']]
+        except (TypeError, ValueError):
+            raise ValueError('years is not [first, last]')
+        if len(years) != 2:
+            raise ValueError('years is not [first, last]')
+
+    if not isinstance(body.get('filter') or '', str):
+        raise ValueError('filter is not a string')
+    # Raises for a term the table filter would not know, or on a column
+    # the queried rows do not have
+    parse_table_filter(body.get('filter'),
+                       MONTH_COLUMNS if 'Month' in group_by else COLUMNS)
+
+    agg = body.get('agg', 'sum')
+    if isinstance(agg, dict):
+        check_names(list(agg), measures, 'measures')
+        check_names(list(agg.values()), AGGS, 'aggregates')
+        agg = {measure: agg.get(measure, 'sum') for measure in measures}
+    else:
+        check_names([agg], AGGS, 'aggregates')
+
+    return {
+        'crimes': get_names(body, 'crimes', crime_types, 'crimes'),
+        'states': sorted(get_names(body, 'states', states, 'states')),
+        'years': years,
+        'filter': body.get('filter') or '',
+        'group_by': group_by,
+        'measures': measures,
+        'agg': agg
+    }
+
+
+def aggregate(dfs, group_by, measures, agg):
+    '''The measures of the rows aggregated over the groups, as floats.
+    Measures stored as float32 keep its precision.'''
+    values = dfs[measures].astype(float)
+
+    if not group_by:
+        result = values.agg(agg)
+        result = (result.to_frame().T if isinstance(result, pd.Series)
+                  else result).reset_index(drop=True)
+    else:
+        result = values.groupby([dfs[group] for group in group_by],
+                                observed=True).agg(agg).reset_index()
+
+    for column in get_float32_columns(dfs[measures]):
+        result[column] = from_float32(result[column])
+
+    return result
+
+
+def to_json(result):
+    '''Columns and rows of a result, missing values as null'''
+    data = result.astype(object).where(result.notna(), None)
+
+    return {'columns': list(result.columns),
+            'data': data.values.tolist()}
+
+
+def from_json(payload):
+
+    return pd.DataFrame(payload['data'], columns=payload['columns'])
+
+
+class Client(object):
+    '''Queries to a running app, for notebooks and jobs that should not
+    load the data themselves:
+
+        client = Client('http://127.0.0.1:8050')
+        client.query(group_by=['State'], measures=['TAVG'], agg='mean')
+    '''
+
+    def __init__(self, url='http://127.0.0.1:8050', timeout=60):
+        self.url = url.rstrip('/') + '/api/query'
+        self.timeout = timeout
+
+    def query(self, **body):
+        '''The result of a query as a DataFrame'''
+        request = Request(self.url, data=json.dumps(body).encode(),
+                          headers={'Content-Type': 'application/json'})
+
+        with urlopen(request, timeout=self.timeout) as response:
+            return from_json(json.loads(response.read().decode()))
@@ -0,0 +1,122 @@
+'''Hot reload of the data while the app keeps serving.
+
+The loaded data lives in a DoubleBuffer. A request pins the data current
+when it starts and reads only that, so a reload swapping in new data
+(one assignment) lets the callbacks in flight finish on the old buffer
+while every later request gets the new one. The old buffer is freed once
+the last request holding it finishes.
+
+A Watcher polls a key of the data files (their sizes and mtimes) and
+loads the new data on its own thread once the key has changed and then
+held for a poll, so files still being written are not read.
+'''
+import functools
+import logging
+import threading
+from contextlib import contextmanager
+
+
+logger = logging.getLogger(__name__)
+
+
+class DoubleBuffer(object):
+    '''The current value, and the value pinned by each thread'''
+
+    def __init__(self, value=None):
+        self._current = value
+        self._local = threading.local()
+
+    def latest(self):
+
+        return self._current
+
+    def current(self):
+        '''The value pinned by this thread, else the latest one'''
+        pinned = getattr(self._local, 'value', None)
+
+        return self._current if pinned is None else pinned
+
+    def swap(self, value):
+        '''Make value the latest, threads keep what they pinned'''
+        old, self._current = self._current, value
+
+        return old
+
+    def pin(self):
+        '''Hold the latest value for this thread until unpin'''
+        self._local.value = self._current
+
+    def unpin(self):
+        self._local.value = None
+
+    @contextmanager
+    def pinned(self):
+        '''Hold the value for the block, the outer one when nested'''
+        outer = getattr(self._local, 'value', None)
+        self._local.value = self.current()
+        try:
+            yield self._local.value
+        finally:
+            self._local.value = outer
+
+    def bind(self, func):
+        '''Wrap func to read the value of this thread when it runs on
+        another thread'''
+        value = self.current()
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            self._local.value = value
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._local.value = None
+
+        return wrapper
+
+    def init_app(self, server):
+        '''Pin the value for every request of the server'''
+        server.before_request(self.pin)
+        server.teardown_request(lambda exception: self.unpin())
+
+
+class Watcher(threading.Thread):
+    '''Call reload when get_key changes, polling every interval seconds.
+    key is the one the data in use was loaded with, get_key() when None.'''
+
+    def __init__(self, get_key, reload, interval, key=None):
+        super(Watcher, self).__init__(name='data-watcher', daemon=True)
+        self.key = key
+        self.get_key = get_key
+        self.reload = reload
+        self.interval = interval
+        self.errors = 0
+        self._stopped = threading.Event()
+
+    def run(self):
+        key = pending = self.key if self.key is not None else self.get_key()
+
+        while not self._stopped.wait(self.interval):
+            new_key = self.get_key()
+
+            # Missing while being replaced, or unchanged
+            if new_key is None or new_key == key:
+                pending = key
+                continue
+
+            # Wait for the files to stop changing
+            if new_key != pending:
+                pending = new_key
+                continue
+
+            try:
+                self.reload()
+            except Exception:
+                # Keep serving the old data and retry on the next poll
+                self.errors += 1
+                logger.exception('Reloading the data failed')
+                continue
+            key = new_key
+
+    def stop(self):
+        self._stopped.set()
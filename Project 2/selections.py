@@ -0,0 +1,93 @@
+'''The selected rows of the data table, per session.
+
+The table only holds the rows of its current page, so the row_ids selected
+on every page are kept on the server by session id instead of being sent
+with every table request. Each session has a file under data/.selections,
+so a selection made through one gunicorn worker is seen by all of them.
+
+The row_ids are the index of the loaded data, which may point at other
+rows once the data is reloaded, so a selection is kept with the key of the
+data it was made on and is empty for any other.
+'''
+import hashlib
+import json
+import os
+import threading
+
+from config import max_sessions
+
+
+SELECTION_DIR = os.path.join('data', '.selections')
+
+# Files written by this process since the oldest were last removed
+_writes = 0
+_lock = threading.Lock()
+
+
+def get_path(session_id, selection_dir=SELECTION_DIR):
+    '''The file of a session, named by a hash as the id is the browser's'''
+    name = hashlib.sha1(session_id.encode('utf-8')).hexdigest()
+
+    return os.path.join(selection_dir, '{}.json'.format(name))
+
+
+def get(session_id, data_key, selection_dir=SELECTION_DIR):
+    '''The row_ids selected in the session on the data, none without a
+    session'''
+
+    if session_id is None:
+        return set()
+
+    try:
+        with open(get_path(session_id, selection_dir)) as f:
+            selection = json.load(f)
+    except (IOError, OSError, ValueError):
+        return set()
+
+    if selection['key'] != data_key:
+        return set()
+
+    return set(selection['rows'])
+
+
+def put(session_id, data_key, row_ids, selection_dir=SELECTION_DIR):
+    '''Keep the row_ids selected in the session on the data'''
+    global _writes
+
+    if session_id is None:
+        return
+
+    path = get_path(session_id, selection_dir)
+    tmp_path = '{}.{}.{}.tmp'.format(path, os.getpid(),
+                                     threading.get_ident())
+
+    try:
+        os.makedirs(selection_dir, exist_ok=True)
+        with open(tmp_path, 'w') as f:
+            json.dump({'key': data_key, 'rows': sorted(row_ids)}, f)
+        os.replace(tmp_path, path)
+    except (IOError, OSError):
+        return
+
+    with _lock:
+        _writes += 1
+        due = _writes >= max_sessions // 10
+        if due:
+            _writes = 0
+
+    if due:
+        prune(selection_dir)
+
+
+def prune(selection_dir=SELECTION_DIR, keep=max_sessions):
+    '''Remove all but the most recently written selections'''
+    try:
+        paths = [os.path.join(selection_dir, name)
+                 for name in os.listdir(selection_dir)
+                 if not name.endswith('.tmp')]
+        paths.sort(key=os.path.getmtime, reverse=True)
+        for path in paths[keep:]:
+            os.remove(path)
+    except (IOError, OSError):
+        # Pruned at the same time by another worker
+        pass
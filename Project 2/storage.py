@@ -0,0 +1,320 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+# Each CSV column is saved as its own .npy file so only the needed columns
+# are memory mapped. The manifest records the size and mtime of the source
+# and the dtype of every column, a copy that no longer matches its CSV (or
+# the requested dtypes) is stale and ignored.
+MANIFEST = 'manifest.json'
+
+# Objects derived from the data, saved to skip rebuilding them on start
+SNAPSHOT_DIR = '.snapshots'
+
+
+def get_column_dir(csv_path):
+
+    data_dir, name = os.path.split(csv_path)
+    stem = os.path.splitext(name)[0]
+
+    return os.path.join(data_dir, '.columns', stem)
+
+
+def get_source_stamp(csv_path):
+
+    stat = os.stat(csv_path)
+
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+
+def read_manifest(csv_path):
+    '''The manifest of a fresh columnar copy, None if missing or stale'''
+    path = os.path.join(get_column_dir(csv_path), MANIFEST)
+
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+    try:
+        if manifest['source'] != get_source_stamp(csv_path):
+            return None
+    except (IOError, OSError):
+        # The CSV is gone, the copy is all there is
+        pass
+
+    return manifest
+
+
+def apply_dtypes(df, dtypes):
+    '''Cast the columns of df that have a dtype in dtypes'''
+
+    if not dtypes:
+        return df
+
+    return df.astype({col: dtype for col, dtype in dtypes.items()
+                      if col in df.columns})
+
+
+def is_fresh(manifest, columns, dtypes=None):
+    '''Whether the copy has the columns, with the requested dtypes'''
+
+    if manifest is None:
+        return False
+
+    for col in columns:
+        entry = manifest['columns'].get(col)
+        if entry is None:
+            return False
+        if dtypes and col in dtypes and entry.get('dtype') != dtypes[col]:
+            return False
+
+    return True
+
+
+def write_atomically(path, write, mode='wb'):
+    '''Call write(f) on a temporary file of this call and move it to path,
+    so processes writing the same file at once never leave a partial one
+    and processes mapping the old file keep reading it'''
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.',
+                                    suffix='.tmp',
+                                    dir=os.path.dirname(path) or '.')
+    try:
+        # Readable by the other workers, as a plain open would create it
+        os.chmod(tmp_path, 0o644)
+        with os.fdopen(fd, mode) as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def save_array(path, values):
+    '''np.save as a new file'''
+
+    write_atomically(path, lambda f: np.save(f, values))
+
+
+def write_columns(df, csv_path, source=None):
+    '''Save every column of df as a .npy file next to csv_path, source is
+    the stamp of the CSV when df was read from it.
+
+    Categorical columns are saved as their codes, nullable integer columns
+    as their values and a missing mask, so both stay memory mapped.
+    '''
+    column_dir = get_column_dir(csv_path)
+    os.makedirs(column_dir, exist_ok=True)
+
+    # Blocks saved from an older conversion
+    for file_name in os.listdir(column_dir):
+        if file_name.startswith('block_'):
+            os.remove(os.path.join(column_dir, file_name))
+
+    columns = {}
+    for i, col in enumerate(df.columns):
+        values = df[col]
+
+        # Column names are not always valid file names
+        file_name = 'col_{:03d}.npy'.format(i)
+        entry = {'file': file_name, 'dtype': str(values.dtype)}
+
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            entry['kind'] = 'category'
+            entry['categories'] = values.cat.categories.tolist()
+            values = values.cat.codes.values
+        elif isinstance(values.dtype, pd.api.extensions.ExtensionDtype)\
+                and values.dtype.kind in 'iu':
+            entry['kind'] = 'nullable'
+            entry['mask'] = 'col_{:03d}_mask.npy'.format(i)
+            save_array(os.path.join(column_dir, entry['mask']),
+                       values.isna().values)
+            values = values.fillna(0).to_numpy(values.dtype.numpy_dtype)
+        elif values.dtype == object:
+            # Fixed width unicode can be memory mapped, '' marks a missing
+            entry['kind'] = 'str'
+            values = values.fillna('').astype(str).values.astype('U')
+        else:
+            entry['kind'] = 'num'
+            values = values.values
+
+        save_array(os.path.join(column_dir, file_name), values)
+        columns[col] = entry
+
+    manifest = {'source': source or get_source_stamp(csv_path),
+                'columns': columns}
+
+    # Write the manifest last so a partial conversion is never used
+    write_atomically(os.path.join(column_dir, MANIFEST),
+                     lambda f: json.dump(manifest, f), 'w')
+
+
+def convert_csv(csv_path, dtypes=None):
+    '''One time conversion of a CSV to the columnar format'''
+    # Stamped before reading, a CSV replaced meanwhile leaves the copy stale
+    source = get_source_stamp(csv_path)
+    df = apply_dtypes(pd.read_csv(csv_path), dtypes)
+    write_columns(df, csv_path, source)
+
+    return df
+
+
+def ensure_columns(csv_path, dtypes=None):
+    '''Convert a CSV unless it already has a fresh columnar copy'''
+    manifest = read_manifest(csv_path)
+
+    if manifest is None or\
+            not is_fresh(manifest, manifest['columns'], dtypes):
+        convert_csv(csv_path, dtypes)
+
+
+def read_block(csv_path, manifest, columns):
+    '''Memory map same dtype columns as one 2D array.
+
+    pandas keeps the columns of a dtype in a single 2D block and copies
+    separate arrays into one on first use. Saving the block for this set
+    of columns lets the frame use the mapped file as is.
+    '''
+    column_dir = get_column_dir(csv_path)
+    key = hashlib.sha1(json.dumps([manifest['source'], columns])
+                       .encode('utf-8')).hexdigest()[:16]
+    path = os.path.join(column_dir, 'block_{}.npy'.format(key))
+
+    if not os.path.exists(path):
+        block = np.stack([
+            np.load(os.path.join(column_dir,
+                                 manifest['columns'][col]['file']),
+                    mmap_mode='r')
+            for col in columns])
+
+        try:
+            save_array(path, block)
+        except (IOError, OSError):
+            return block
+
+    return np.load(path, mmap_mode='r')
+
+
+def read_columns(csv_path, columns, dtypes=None, manifest=None):
+    '''Memory map the requested columns, None if they are not available
+    (or not saved with the requested dtypes)'''
+    manifest = manifest or read_manifest(csv_path)
+
+    if not is_fresh(manifest, columns, dtypes):
+        return None
+
+    column_dir = get_column_dir(csv_path)
+
+    data = OrderedDict()
+    for col in columns:
+        entry = manifest['columns'][col]
+        values = np.load(os.path.join(column_dir, entry['file']),
+                         mmap_mode='r')
+
+        if entry['kind'] == 'str':
+            values = pd.Series(values.astype(object)).replace('', np.nan)
+        elif entry['kind'] == 'category':
+            values = pd.Categorical.from_codes(values, entry['categories'])
+        elif entry['kind'] == 'nullable':
+            mask = np.load(os.path.join(column_dir, entry['mask']),
+                           mmap_mode='r')
+            values = pd.arrays.IntegerArray(values, mask)
+
+        data[col] = values
+
+    # Numeric columns grouped by dtype, each group becomes one block
+    groups = OrderedDict()
+    for col, values in data.items():
+        if isinstance(values, np.ndarray):
+            groups.setdefault(values.dtype, []).append(col)
+
+    # Start from the largest block, without a copy it stays backed by the
+    # file so processes reading the same data share the pages
+    block_columns = max(groups.values(), key=len) if groups else []
+    if len(block_columns) > 1:
+        block = read_block(csv_path, manifest, block_columns)
+        df = pd.DataFrame(block.T, columns=block_columns, copy=False)
+    else:
+        df = pd.DataFrame(index=pd.RangeIndex(len(next(iter(data.values())))))
+
+    # Insert the rest in place, so the column order is the requested one
+    for i, col in enumerate(columns):
+        if col not in df.columns:
+            df.insert(i, col, data[col])
+
+    return df
+
+
+def read_csv(csv_path, columns, dtypes=None):
+    '''Read columns of a CSV with the given dtypes, from its columnar copy
+    when that is fresh and otherwise by parsing (and converting) the CSV'''
+    df = read_columns(csv_path, columns, dtypes)
+
+    if df is not None:
+        return df
+
+    try:
+        df = convert_csv(csv_path, dtypes)
+    except (IOError, OSError):
+        return apply_dtypes(pd.read_csv(csv_path, usecols=columns)[columns],
+                            dtypes)
+
+    return df[columns]
+
+
+def get_files_key(paths):
+    '''Hash of the size and mtime of the files, None if one is missing'''
+    try:
+        stamps = [get_source_stamp(path) for path in paths]
+    except (IOError, OSError):
+        return None
+
+    return hashlib.sha1(json.dumps([paths, stamps]).encode('utf-8'))\
+        .hexdigest()
+
+
+def read_snapshot(data_dir, name, key):
+    '''The snapshot saved with the key, None if missing or for another'''
+    path = os.path.join(data_dir, SNAPSHOT_DIR, name + '.pkl')
+
+    try:
+        with open(path, 'rb') as f:
+            snapshot_key, value = pickle.load(f)
+    except Exception:
+        # Missing, partial or pickled by other versions of the libraries
+        return None
+
+    return value if snapshot_key == key else None
+
+
+def write_snapshot(data_dir, name, key, value):
+
+    snapshot_dir = os.path.join(data_dir, SNAPSHOT_DIR)
+    path = os.path.join(snapshot_dir, name + '.pkl')
+
+    try:
+        os.makedirs(snapshot_dir, exist_ok=True)
+        write_atomically(path, lambda f: pickle.dump(
+            (key, value), f, protocol=pickle.HIGHEST_PROTOCOL))
+    except (IOError, OSError):
+        pass
+
+
+if __name__ == '__main__':
+    import sys
+
+    from config import column_dtypes
+
+    # With the dtypes the app reads, so it uses the copy as is
+    for path in sys.argv[1:]:
+        convert_csv(path, column_dtypes)
+        print('Converted {}'.format(path))
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The modules of the app are imported from the Project 2 directory
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
@@ -0,0 +1,87 @@
+import base64
+import json
+
+import numpy as np
+import pandas as pd
+import plotly
+import plotly.graph_objs as go
+
+import encoding
+
+
+def to_json(fig):
+    '''The figure as the browser receives it'''
+
+    return json.loads(json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder))
+
+
+def decode(value):
+    '''An array of the figure as assets/decode_figures.js decodes it'''
+
+    if isinstance(value, dict) and 'bdata' in value:
+        array = np.frombuffer(base64.b64decode(value['bdata']),
+                              '<' + value['dtype'])
+        return array.reshape(value['shape']) if 'shape' in value else array
+    if isinstance(value, dict) and 'labels' in value:
+        return np.array(value['labels'], dtype=object)[decode(
+            value['codes'])]
+
+    return value
+
+
+def assert_same_values(decoded, plain):
+    '''The decoded array holds the values of the JSON one, missing values
+    as NaN and ints as ints when a 32 bit typed array holds them'''
+    decoded = np.asarray(decoded)
+    plain = np.array(plain, dtype=object)
+
+    assert decoded.shape == plain.shape
+    if decoded.dtype.kind in 'iuf':
+        expected = np.where(plain == None, np.nan, plain)  # noqa: E711
+        assert np.array_equal(decoded.astype(float),
+                              expected.astype(float), equal_nan=True)
+        if any(isinstance(value, float) and value != int(value)
+               for value in plain.ravel() if value is not None):
+            assert decoded.dtype.kind == 'f'
+        if all(isinstance(value, int) and abs(value) < 2 ** 31
+               for value in plain.ravel()):
+            assert decoded.dtype.kind in 'iu'
+    else:
+        assert decoded.tolist() == plain.tolist()
+
+
+def test_encoded_figure_decodes_to_the_plain_figure():
+    dates = pd.date_range('2000-01-01', periods=12, freq='MS')
+    fig = {
+        'data': [
+            go.Scatter(x=dates, y=np.array([1.5, np.nan] * 6),
+                       customdata=np.arange(24).reshape(12, 2),
+                       text=np.array(['TX', 'CA', 'NY'] * 4, dtype=object)),
+            go.Choropleth(locations=np.array(['TX'] * 12, dtype=object),
+                          z=np.array([3., 4., 70000.] * 4)),
+            go.Scatter(x=np.arange(12, dtype=np.int64) * 10 ** 10,
+                       y=np.linspace(0, 1, 12).astype(np.float32)),
+            # Too short to pack
+            go.Scatter(x=[1, 2], y=[0.5, np.nan])
+        ],
+        'layout': {'title': 'Test'}
+    }
+
+    plain = to_json(fig)
+    encoded = to_json(encoding.encode_figure(fig))
+
+    assert encoded['layout'] == plain['layout']
+    for encoded_trace, plain_trace in zip(encoded['data'], plain['data']):
+        assert set(encoded_trace) == set(plain_trace)
+        for key, value in plain_trace.items():
+            if key in encoding.ARRAY_KEYS:
+                assert_same_values(decode(encoded_trace[key]), value)
+            else:
+                assert encoded_trace[key] == value
+
+    # Datetime axes stay dates, float counts are sent as ints and ints
+    # past 32 bits as exact floats
+    assert encoded['data'][0]['x'] == plain['data'][0]['x']
+    assert encoded['data'][1]['z']['dtype'] == 'i4'
+    assert encoded['data'][2]['x']['dtype'] == 'f8'
+    assert encoded['data'][2]['y']['dtype'] == 'f4'
@@ -0,0 +1,42 @@
+import json
+
+import pytest
+
+import export
+
+
+STATES = ['CA', 'TX']
+YEARS = [1995, 2016]
+
+
+def parse_spec(spec, filter=''):
+
+    return export.parse_query({'spec': json.dumps(spec), 'filter': filter},
+                              STATES, YEARS)
+
+
+def test_spec_is_checked_like_the_query_string():
+    spec = {'crimes': ['Homicide'], 'states': ['TX'], 'years': [2000, 2010]}
+    parsed = parse_spec(spec, '"Homicide" > 1')
+
+    assert (parsed['crimes'], parsed['states'], parsed['years']) ==\
+        (['Homicide'], ['TX'], [2000, 2010])
+
+    for bad in [{'states': 'TX'}, {'states': ['XX']},
+                {'years': ['a', 'b']}, {'years': [2000]},
+                {'years': [1990, 2000]}, {'years': [2010, 2000]},
+                {'crimes': 'Homicide'}]:
+        with pytest.raises(ValueError):
+            parse_spec(dict(spec, **bad))
+
+
+def test_filter_on_unknown_column_raises():
+
+    # Only the columns of the table, so not the unchecked crimes
+    for filter in ['"Stat" eq TX', '"Robbery" > 1']:
+        with pytest.raises(ValueError, match='Unknown filter column'):
+            parse_spec({'crimes': ['Homicide'], 'states': ['TX'],
+                        'years': [2000, 2010]}, filter)
+        with pytest.raises(ValueError, match='Unknown filter column'):
+            export.parse_query({'crimes': 'Homicide', 'filter': filter},
+                               STATES, YEARS)
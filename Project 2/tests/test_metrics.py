@@ -0,0 +1,57 @@
+import os
+
+import metrics
+
+
+def write_worker(metrics_dir, pid, count):
+    '''The file of a worker that served count requests of one callback'''
+    buckets = len(metrics.SECONDS_BUCKETS)
+
+    metrics.write_state(metrics.get_path(pid, metrics_dir), {
+        'histograms': {'dash_callback_duration_seconds': {
+            'table.data': [count] * buckets + [0.1 * count, count]}},
+        'counters': {'dash_callback_superseded_total': {'table.data': 1}},
+        'gauges': {'dash_data_generation': 1},
+        'startup': {'total': 1.5},
+        'caches': {'figures': {'hits': count, 'misses': 1,
+                               'evictions': 0}}})
+
+
+def test_exited_workers_are_folded_into_one_file(tmp_path, monkeypatch):
+    metrics_dir = str(tmp_path)
+    monkeypatch.setattr(metrics, 'METRICS_DIR', metrics_dir)
+
+    for pid, count in [(101, 2), (102, 3), (103, 4)]:
+        write_worker(metrics_dir, pid, count)
+    metrics.mark_process_dead(101, metrics_dir)
+    metrics.mark_process_dead(102, metrics_dir)
+    # Already folded
+    metrics.mark_process_dead(102, metrics_dir)
+
+    assert sorted(os.listdir(metrics_dir)) == [
+        '103.json', 'exited.json', 'exited.lock']
+
+    states = dict(metrics.get_states())
+    assert states['exited']['gauges'] == states['exited']['startup'] == {}
+
+    histograms, counters, caches = metrics.merge_states(states.items())
+    assert histograms['dash_callback_duration_seconds']['table.data'][-1]\
+        == 9
+    assert counters['dash_callback_superseded_total']['table.data'] == 3
+    assert caches['figures']['hits'] == 9
+
+
+def test_flush_is_throttled(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, 'METRICS_DIR', str(tmp_path))
+    path = metrics.get_path(os.getpid(), str(tmp_path))
+
+    metrics.increment('dash_callback_superseded_total', 'test')
+    metrics.flush()
+    os.remove(path)
+
+    # Not again within the interval, but on a forced flush
+    metrics.increment('dash_callback_superseded_total', 'test')
+    metrics.flush(60)
+    assert not os.path.exists(path)
+    metrics.flush()
+    assert os.path.exists(path)
@@ -0,0 +1,76 @@
+import os
+import shutil
+
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+import pipeline
+
+from conftest import PROJECT_DIR
+
+
+DATA_DIR = os.path.join(PROJECT_DIR, 'data')
+
+
+def copy_data(tmp_path):
+    '''The shipped sources and outputs in a directory of their own'''
+
+    for name in os.listdir(DATA_DIR):
+        if name.endswith('.csv'):
+            shutil.copy(os.path.join(DATA_DIR, name), str(tmp_path))
+
+    return str(tmp_path)
+
+
+def read_output(data_dir, name):
+
+    return pd.read_csv(os.path.join(data_dir, name))
+
+
+def test_full_rebuild_matches_shipped_outputs(tmp_path):
+    data_dir = copy_data(tmp_path)
+
+    pipeline.refresh(data_dir, full=True)
+
+    # Same rows in the same order, the means equal to the last bit or two
+    for name in pipeline.OUTPUTS:
+        assert_frame_equal(read_output(data_dir, name),
+                           read_output(DATA_DIR, name))
+
+    with open(os.path.join(data_dir, 'Year_df.csv'), 'rb') as f:
+        assert f.readline().endswith(b'\r\n')
+
+
+def test_refresh_recomputes_changed_year_in_place(tmp_path):
+    data_dir = copy_data(tmp_path)
+    pipeline.refresh(data_dir, full=True)
+
+    crimes_path = os.path.join(data_dir, 'Crimes.csv')
+    crimes = pd.read_csv(crimes_path)
+    row = (crimes['Year'] == 2010) & (crimes['State_Abbrev'] == 'TX')
+    crimes.loc[row, 'homicide'] += 1
+    crimes.to_csv(crimes_path, index=False)
+
+    assert pipeline.refresh(data_dir) == {'Year_df.csv': [2010],
+                                          'Month_df.csv': []}
+
+    expected = read_output(DATA_DIR, 'Year_df.csv')
+    expected.loc[(expected['Year'] == 2010) &
+                 (expected['State'] == 'Texas'), 'homicide'] += 1
+    assert_frame_equal(read_output(data_dir, 'Year_df.csv'), expected)
+
+
+def test_refresh_drops_year_removed_from_source(tmp_path):
+    data_dir = copy_data(tmp_path)
+    pipeline.refresh(data_dir, full=True)
+
+    income_path = os.path.join(data_dir, 'Income.csv')
+    income = pd.read_csv(income_path)
+    income[income['Year'] != 2016].to_csv(income_path, index=False)
+
+    assert pipeline.refresh(data_dir)['Year_df.csv'] == [2016]
+
+    expected = read_output(DATA_DIR, 'Year_df.csv')
+    expected = expected[expected['Year'] != 2016].reset_index(drop=True)
+    assert_frame_equal(read_output(data_dir, 'Year_df.csv'), expected)
+    assert '2016' not in pipeline.read_manifest(data_dir)['Income.csv']
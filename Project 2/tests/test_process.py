@@ -0,0 +1,77 @@
+import pandas as pd
+import pytest
+
+import process
+
+
+def make_rows():
+
+    return pd.DataFrame({
+        'State': ['Texas', 'Ohio', 'Iowa', 'Utah'],
+        'Year': [2009, 2010, 2011, 2012],
+        'Burglary': [3., 1., 4., 2.],
+        'Robbery': [1., 2., 3., 4.]
+    })
+
+
+def get_order(dfs, sorting_settings, filtering_settings=''):
+
+    def get_ranks(column, direction):
+        return process.get_sort_ranks(dfs[column].values, direction)
+
+    return process.get_table_order(
+        process.get_table_mask(dfs, filtering_settings), sorting_settings,
+        get_ranks, dfs.columns)
+
+
+def test_sort_by_column_not_in_rows_is_skipped():
+    # Sorted by a crime, then the crime is unchecked
+    dfs = make_rows().drop(columns='Burglary')
+    sorting = [{'column_id': 'Burglary', 'direction': 'asc'},
+               {'column_id': 'Robbery', 'direction': 'desc'}]
+
+    assert get_order(dfs, sorting).tolist() == [3, 2, 1, 0]
+
+
+def test_sort_by_column():
+    sorting = [{'column_id': 'Burglary', 'direction': 'asc'}]
+
+    assert get_order(make_rows(), sorting).tolist() == [1, 3, 0, 2]
+
+
+def test_filter_word_operators_in_any_case():
+    dfs = make_rows()
+
+    assert get_order(dfs, [], '"Year" gt 2010').tolist() == [2, 3]
+    assert get_order(dfs, [], '"Year" LE 2010').tolist() == [0, 1]
+    assert get_order(dfs, [], '"State" EQ Texas').tolist() == [0]
+    assert get_order(dfs, [], '"Year" ge 2010 && "Robbery" lt 4')\
+        .tolist() == [1, 2]
+
+
+def test_unparsable_filter_raises():
+    dfs = make_rows()
+
+    for filtering_settings in ['"Year" between 2010',
+                               '"Year" gt 2010 && Texas']:
+        with pytest.raises(ValueError):
+            process.get_table_mask(dfs, filtering_settings)
+
+
+def test_filter_on_unknown_column_raises():
+    dfs = make_rows()
+
+    with pytest.raises(ValueError, match='Stat'):
+        process.get_table_mask(dfs, '"Stat" eq Texas')
+    with pytest.raises(ValueError, match='Robbery'):
+        process.get_table_mask(dfs, '"Robbery" gt 1', ['State', 'Year'])
+
+
+def test_table_page_floats_keep_float32_precision():
+    dfs = make_rows().astype({'Burglary': 'float32'})
+    dfs.loc[0, 'Burglary'] = 58.9333
+    page = process.get_table_page(dfs, [0, 1], {'current_page': 0,
+                                                'page_size': 2})
+
+    assert page[0]['Burglary'] == 58.9333
+    assert page[1]['Burglary'] == 1.0
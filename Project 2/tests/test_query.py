@@ -0,0 +1,28 @@
+import pytest
+
+import query
+
+
+STATES = ['CA', 'TX']
+YEARS = [1995, 2016]
+
+
+def test_filter_columns_are_those_of_the_rows():
+    parsed = query.parse_query({'filter': '"TAVG" > 60 && "State" eq Texas'},
+                               STATES, YEARS)
+
+    assert parsed['filter'] == '"TAVG" > 60 && "State" eq Texas'
+    assert query.parse_query({'filter': '"Month" > 6',
+                              'group_by': ['Month'], 'measures': ['TAVG']},
+                             STATES, YEARS)['filter'] == '"Month" > 6'
+
+
+def test_filter_on_unknown_column_raises():
+
+    # Yearly rows have no Month, monthly ones no crimes
+    for body in [{'filter': '"Month" > 6'},
+                 {'filter': '"Stat" eq TX'},
+                 {'filter': '"Homicide" > 1', 'group_by': ['Month'],
+                  'measures': ['TAVG']}]:
+        with pytest.raises(ValueError, match='Unknown filter column'):
+            query.parse_query(body, STATES, YEARS)
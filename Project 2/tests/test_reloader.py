@@ -0,0 +1,46 @@
+import threading
+
+import reloader
+
+
+def run_watcher(keys, reload):
+    '''Run a watcher over the keys, one per poll, until they run out'''
+    keys = iter(keys)
+    done = threading.Event()
+
+    def get_key():
+        try:
+            return next(keys)
+        except StopIteration:
+            done.set()
+            return None
+
+    watcher = reloader.Watcher(get_key, reload, 0.001, key='a')
+    watcher.start()
+    done.wait(5)
+    watcher.stop()
+    watcher.join(5)
+
+    return watcher
+
+
+def test_reload_once_the_key_holds():
+    reloads = []
+
+    run_watcher(['a', 'b', 'b', 'b', 'b'], lambda: reloads.append(1))
+
+    assert reloads == [1]
+
+
+def test_failed_reload_is_retried():
+    calls = []
+
+    def reload():
+        calls.append(1)
+        if len(calls) == 1:
+            raise IOError('partial file')
+
+    watcher = run_watcher(['b', 'b', 'b', 'b'], reload)
+
+    assert len(calls) == 2
+    assert watcher.errors == 1
@@ -0,0 +1,48 @@
+import os
+
+import selections
+
+
+def test_selection_is_kept_per_session_and_data(tmp_path):
+    selection_dir = str(tmp_path)
+
+    selections.put('a', 'data 1', {3, 1}, selection_dir)
+    selections.put('b', 'data 1', {2}, selection_dir)
+
+    assert selections.get('a', 'data 1', selection_dir) == {1, 3}
+    assert selections.get('b', 'data 1', selection_dir) == {2}
+    assert selections.get('c', 'data 1', selection_dir) == set()
+
+    # The row_ids may point at other rows of reloaded data
+    assert selections.get('a', 'data 2', selection_dir) == set()
+
+
+def test_without_session_nothing_is_kept(tmp_path):
+    selection_dir = str(tmp_path)
+
+    selections.put(None, 'data 1', {1}, selection_dir)
+
+    assert os.listdir(selection_dir) == []
+    assert selections.get(None, 'data 1', selection_dir) == set()
+
+
+def test_session_id_does_not_name_the_file(tmp_path):
+    selection_dir = str(tmp_path)
+
+    selections.put('../a', 'data 1', {1}, selection_dir)
+
+    assert len(os.listdir(selection_dir)) == 1
+    assert selections.get('../a', 'data 1', selection_dir) == {1}
+
+
+def test_prune_keeps_the_latest(tmp_path):
+    selection_dir = str(tmp_path)
+
+    for i, session_id in enumerate(['a', 'b', 'c']):
+        selections.put(session_id, 'data 1', {i}, selection_dir)
+        path = selections.get_path(session_id, selection_dir)
+        os.utime(path, (i, i))
+    selections.prune(selection_dir, keep=2)
+
+    assert selections.get('a', 'data 1', selection_dir) == set()
+    assert selections.get('c', 'data 1', selection_dir) == {2}
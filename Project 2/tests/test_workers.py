@@ -0,0 +1,54 @@
+import os
+import shutil
+import sys
+
+import pandas as pd
+import pytest
+
+from conftest import PROJECT_DIR
+
+sys.path.insert(0, os.path.join(PROJECT_DIR, 'benchmarks'))
+
+import check_workers  # noqa: E402
+import synthetic  # noqa: E402
+
+
+pytestmark = pytest.mark.skipif(
+    not os.path.exists('/proc/self/smaps_rollup'), reason='reads /proc')
+
+
+@pytest.fixture(scope='module')
+def project_dir(tmp_path_factory):
+    '''The app in a directory of its own, with 40 times the states so a
+    copy of the data stands out from the noise of the allocator'''
+    pytest.importorskip('gunicorn')
+    path = str(tmp_path_factory.mktemp('project'))
+
+    for name in os.listdir(PROJECT_DIR):
+        if name.endswith('.py') or name == 'assets':
+            copy = shutil.copytree if name == 'assets' else shutil.copy
+            copy(os.path.join(PROJECT_DIR, name), os.path.join(path, name))
+
+    data_dir = os.path.join(path, 'data')
+    os.mkdir(data_dir)
+    for name in ['Year_df.csv', 'Month_df.csv']:
+        shutil.copy(os.path.join(PROJECT_DIR, 'data', name), data_dir)
+
+    df = pd.read_csv(os.path.join(data_dir, 'Year_df.csv'))
+    synthetic.scale_states(df, 40).to_csv(
+        os.path.join(data_dir, 'Year_df.csv'), index=False)
+
+    return path
+
+
+def test_worker_memory_is_bounded(project_dir):
+    n_workers = 3
+
+    before, after, dataset = check_workers.measure(n_workers, 32,
+                                                   project_dir)
+
+    assert len(after) == n_workers
+    for pid, (rss, pss, uss) in after.items():
+        # The data is mapped, not held, by every worker
+        assert pss < rss
+        assert uss - before[pid][2] < dataset
@@ -0,0 +1,94 @@
+'''Per session request versions.
+
+The browser sends a new callback request on every slider release or
+dropdown edit without waiting for the previous one, and only shows the
+latest response. The work of a request is dropped once a strictly newer
+request of the same callback, or a strictly newer filter spec, is known
+from the same session.
+
+Each filter spec carries its version, the time update_spec received its
+request, so the figure and table requests made from it carry it too and
+are ordered the same in every worker. A worker only knows the requests it
+has served itself, so it never drops a request for one another worker
+has seen: it may do work the browser discards, but never drops work the
+browser waits for. A request without a version, or of a session the
+worker does not know, is never dropped.
+
+A session is one page load, told apart by the id the layout is served
+with. Without an id (benchmarks, notebooks) nothing is versioned.
+'''
+import threading
+import time
+from collections import namedtuple
+
+import cache
+
+from config import max_sessions
+
+
+# The request of a callback from a session, and its place in the order
+Version = namedtuple('Version', ['key', 'number'])
+
+# (session, callback): latest version number, (session, 'spec'): latest
+# filter spec version. Unnamed so reloading the data does not clear them.
+_latest = cache.LRUCache(maxsize=max_sessions * 4)
+_lock = threading.Lock()
+
+
+def stamp():
+    '''The version of a new filter spec, increasing across workers'''
+
+    return time.time_ns() // 1000
+
+
+def begin(session_id, callback):
+    '''Number a new request of the callback, None without a session'''
+
+    if session_id is None:
+        return None
+
+    key = (session_id, callback)
+    with _lock:
+        number = _latest.get(key, 0) + 1
+        _latest.put(key, number)
+
+    return Version(key, number)
+
+
+def is_current(version):
+    '''False once a newer request of the same callback has arrived'''
+
+    if version is None:
+        return True
+
+    latest = _latest.get(version.key)
+
+    return latest is None or latest <= version.number
+
+
+def is_current_spec(session_id, spec_version):
+    '''Record the filter spec version as seen from the session, False
+    when a strictly newer one has been'''
+
+    if session_id is None or spec_version is None:
+        return True
+
+    key = (session_id, 'spec')
+    with _lock:
+        latest = _latest.get(key)
+        if latest is None or latest < spec_version:
+            _latest.put(key, spec_version)
+            return True
+
+    return latest <= spec_version
+
+
+def set_spec(version, spec_version):
+    '''Record the filter spec made by a request as the latest of the
+    session, False when the request or the spec is superseded'''
+
+    if version is None:
+        return True
+
+    return is_current(version) and is_current_spec(version.key[0],
+                                                   spec_version)
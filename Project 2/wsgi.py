@@ -0,0 +1,9 @@
+# Production entry point, serve with
+#
+#     gunicorn -c gunicorn.conf.py wsgi:server
+#
+# The data files are converted to memory mappable column files once, before
+# any worker starts (see gunicorn.conf.py). Every worker then maps the same
+# files read only, so the dataset lives once in the page cache and memory
+# does not grow with the number of workers.
+from app import server  # noqa: F401